@@ -5,21 +5,26 @@ import os
 import re
 import shutil
 import subprocess
+from contextlib import suppress
+from pathlib import Path
 from time import time
+from typing import Optional
 
-from grablib.build import SassGenerator, insert_hash
+from grablib.build import SassGenerator
 from grablib.common import GrablibError
 from grablib.download import Downloader
 from pygments.formatters.html import HtmlFormatter
 
-from .common import HarrierProblem, clean_uri, log_complete, norm_path_ref
+from .cache import AssetManifest, file_key
+from .common import HarrierProblem, clean_uri, log_complete, norm_path_ref, path_match_set
 from .config import Config, Mode
 from .extensions import ExtensionError
+from .output import OutputWriter, hash_file
 
 logger = logging.getLogger('harrier.assets')
 
 
-def run_grablib(config: Config):
+def run_grablib(config: Config, index: 'PathIndex' = None):
     start = time()
     download_root = config.theme_dir / 'libs'
     log_msg = False
@@ -44,7 +49,7 @@ def run_grablib(config: Config):
         out_dir_src = output_dir / '.src'
         out_dir_src.is_dir() and shutil.rmtree(out_dir_src)
 
-        path_lookup = get_path_lookup(config)
+        path_lookup = get_path_lookup(config) if index is None else index.lookup()
         custom_functions = {
             'resolve_path': lambda path: f"'{resolve_path(path, path_lookup, config)}'",
             'smart_url': lambda path: f"url('{resolve_path(path, path_lookup, config)}')",
@@ -84,38 +89,46 @@ def pygments_importer(path: str):
 IGNORED_FILES = {'.DS_Store'}
 
 
-def copy_assets(config: Config):
+def copy_assets(config: Config, outputs: dict = None, manifest: AssetManifest = None, changed: set = None):
+    """
+    Copy theme assets to dist_dir, if outputs is set the path of each output is added to it with the output's
+    name before a hash was inserted, relative to dist_dir.
+
+    With a manifest, only new or changed assets are hashed and copied and outputs of deleted assets are removed,
+    changed limits the assets checked to those paths, otherwise every asset is checked.
+    """
     start = time()
     in_dir = config.theme_dir / 'assets'
     if not in_dir.is_dir():
         return
     out_dir = config.dist_dir / config.dist_dir_assets
     out_dir.relative_to(config.dist_dir)
+    in_paths = in_dir.glob('**/*') if changed is None else changed
+    in_paths = {p for p in in_paths if p.is_file() and p.name not in IGNORED_FILES}
     copied = 0
-    for in_path in in_dir.glob('**/*'):
-        if not in_path.is_file() or in_path.name in IGNORED_FILES:
-            continue
-        out_path = out_dir / in_path.relative_to(in_dir)
-        path_ref = norm_path_ref(in_path, in_dir)
-        if config.mode == Mode.production and not any(path_match(path_ref) for path_match in config.no_hash):
-            out_path = insert_hash(out_path, in_path.read_bytes())
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-
-        config.extensions.load()
-        applied_extension = False
-        for path_match, f in config.extensions.copy_modifiers:
-            if path_match(path_ref):
-                try:
-                    applied_extension = f(in_path, out_path, config=config)
-                except Exception as e:
-                    logger.exception('%s error running copy extension %s', in_path, f.__name__)
-                    raise ExtensionError(str(e)) from e
-                if applied_extension:
-                    break
-
-        if not applied_extension:
-            shutil.copy(in_path, out_path)
-        copied += 1
+    # copy extensions are run here, other files are copied by the writer's threads
+    writer = OutputWriter.from_config(config)
+    try:
+        for in_path in sorted(in_paths):
+            out_path = _copy_asset(config, in_path, in_dir, out_dir, manifest, writer)
+            if out_path:
+                copied += 1
+            elif manifest:
+                out_path = manifest.assets[in_path][2]
+            if outputs is not None:
+                outputs[out_path] = str((out_dir / in_path.relative_to(in_dir)).relative_to(config.dist_dir))
+    except Exception:
+        with suppress(Exception):
+            writer.close()
+        raise
+    # all copies must be finished before empty directories are removed
+    writer.close()
+
+    if manifest:
+        deleted = (manifest.assets.keys() if changed is None else changed) - in_paths
+        for in_path in deleted & manifest.assets.keys():
+            _remove_output(manifest.assets.pop(in_path)[2], out_dir)
+
     logger.debug(
         'copied %d theme assets from "%s" to "%s"',
         copied,
@@ -127,9 +140,100 @@ def copy_assets(config: Config):
     return copied
 
 
+def _copy_asset(
+    config: Config,
+    in_path: Path,
+    in_dir: Path,
+    out_dir: Path,
+    manifest: Optional[AssetManifest],
+    writer: OutputWriter,
+):
+    """
+    Copy an asset, returns the output path or None if a manifest is used and the output is up to date.
+    """
+    last = manifest and manifest.assets.get(in_path)
+    key = manifest and file_key(in_path)
+    if last and last[0] == key and last[2].exists():
+        return
+
+    # hashed in chunks, then copied by shutil which uses sendfile where available, so memory use doesn't depend on
+    # the size of the asset
+    content_hash = hash_file(in_path)
+    out_path = out_dir / in_path.relative_to(in_dir)
+    path_ref = norm_path_ref(in_path, in_dir)
+    if config.mode == Mode.production and not path_match_set(config.no_hash)(path_ref):
+        out_path = insert_content_hash(out_path, content_hash)
+
+    if last and last[2] != out_path:
+        # the new output is in the same directory, so the directory isn't removed
+        _remove_output(last[2])
+    if manifest:
+        manifest.assets[in_path] = key, content_hash, out_path
+        if last and last[1] == content_hash and out_path.exists():
+            # only the mtime has changed
+            return
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    config.extensions.load()
+    applied_extension = False
+    for path_match, f in config.extensions.copy_modifiers:
+        if path_match(path_ref):
+            try:
+                applied_extension = f(in_path, out_path, config=config)
+            except Exception as e:
+                logger.exception('%s error running copy extension %s', in_path, f.__name__)
+                raise ExtensionError(str(e)) from e
+            if applied_extension:
+                break
+
+    if not applied_extension:
+        writer.copy_file(in_path, out_path)
+    return out_path
+
+
+def insert_content_hash(path: Path, content_hash: bytes, hash_length=7) -> Path:
+    """
+    Insert an md5 hash into the path after the first dot, equivalent to grablib's insert_hash but the hash is
+    calculated by the caller.
+    """
+    hash_ = content_hash.hex()[:hash_length]
+    if '.' in path.name:
+        new_name = re.sub(r'\.', f'.{hash_}.', path.name, count=1)
+    else:
+        new_name = f'{path.name}.{hash_}'
+    return path.with_name(new_name)
+
+
+def _remove_output(out_path: Path, out_dir: Path = None):
+    """
+    Remove an asset output, if out_dir is set then directories between the output and out_dir left empty are removed.
+    """
+    # lexists so symlinks whose source has been deleted are also removed
+    if os.path.lexists(out_path):
+        logger.debug('removing stale asset output "%s"', out_path)
+        out_path.unlink()
+    d = out_path.parent
+    while out_dir and d != out_dir and d.is_dir() and not any(d.iterdir()):
+        d.rmdir()
+        d = d.parent
+
+
 def assets_grablib(config: Config):
-    copy_assets(config)
-    run_grablib(config)
+    """
+    Copy theme assets and build sass, returns the outputs of copy_assets and the index used to resolve paths in
+    sass so the build can reuse it rather than scanning dist_dir again. The index is None if there's no sass.
+    """
+    outputs = {}
+    manifest = AssetManifest.load(config) if config.build_cache else None
+    copy_assets(config, outputs, manifest)
+    manifest and manifest.save()
+    index = None
+    if (config.theme_dir / 'sass').is_dir():
+        index = PathIndex(config)
+        index.scan()
+        index.register(outputs)
+    run_grablib(config, index)
+    return outputs, index
 
 
 def webpack_configuration(config: Config, watch: bool):
@@ -210,20 +314,122 @@ async def start_webpack_watch(config: Config):
 
 
 def get_path_lookup(config: Config, pages=None):
-    d = {}
-    for p in config.dist_dir.glob('**/*'):
-        if p.is_file():
-            rel_path = str(p.relative_to(config.dist_dir))
-            path_name = re.sub(r'\.[a-f0-9]{7,20}\.', '.', rel_path)
-            path_name = re.sub(r'\.[a-f0-9]{7,20}$', '', path_name)
-            d[path_name] = clean_uri(rel_path, config), False, f'{p.stat().st_mtime:0.0f}'
-    last_mod = f'{config.build_time:%s}'
-    if pages:
-        for p in pages.values():
-            if p.get('output', True):
-                uri = p['uri']
-                d[uri.strip('/')] = uri, True, last_mod
-    return d
+    index = PathIndex(config)
+    index.scan()
+    return index.lookup(pages)
+
+
+class PathIndex:
+    """
+    Files in dist_dir used to build path_lookup. "harrier dev" keeps the index between builds and updates it with
+    the files written and removed by each step rather than scanning the whole of dist_dir on every rebuild.
+
+    Names are found by removing hashes from file names unless they're registered by the step which inserted
+    the hash, registered names take priority and hashed files with the same name are treated as stale, use
+    prune() to remove them.
+    """
+
+    __slots__ = 'config', 'files', 'registered'
+
+    def __init__(self, config: Config):
+        self.config = config
+        # path relative to dist_dir: (name, path_lookup entry)
+        self.files = {}
+        # path relative to dist_dir: name, for files whose name is known
+        self.registered = {}
+
+    def scan(self, directory: Path = None):
+        """
+        Scan dist_dir or a directory within it, entries for files in the directory which no longer exist are removed.
+        """
+        dist_dir = self.config.dist_dir
+        directory = directory or dist_dir
+        if directory == dist_dir:
+            self.files = {}
+        else:
+            prefix = f'{directory.relative_to(dist_dir)}{os.sep}'
+            self.files = {k: v for k, v in self.files.items() if not k.startswith(prefix)}
+        self.add(directory.glob('**/*'))
+
+    def add(self, paths):
+        for p in paths:
+            if p.is_file():
+                rel_path = str(p.relative_to(self.config.dist_dir))
+                name = self.registered.get(rel_path)
+                if name is None:
+                    name = re.sub(r'\.[a-f0-9]{7,20}\.', '.', rel_path)
+                    name = re.sub(r'\.[a-f0-9]{7,20}$', '', name)
+                self.files[rel_path] = name, (clean_uri(rel_path, self.config), False, f'{p.stat().st_mtime:0.0f}')
+
+    def register(self, outputs: dict):
+        """
+        Add files whose name is known, outputs should be a dict of paths to names relative to dist_dir.
+        """
+        for p, name in outputs.items():
+            self.registered[str(p.relative_to(self.config.dist_dir))] = name
+        self.add(outputs)
+
+    def remove(self, paths):
+        for p in paths:
+            rel_path = str(p.relative_to(self.config.dist_dir))
+            self.files.pop(rel_path, None)
+            self.registered.pop(rel_path, None)
+
+    def lookup(self, pages=None) -> dict:
+        sources, _ = self._resolve()
+        d = {name: self.files[rel_path][1] for name, rel_path in sources.items()}
+        last_mod = f'{self.config.build_time:%s}'
+        if pages:
+            for p in pages.values():
+                if p.get('output', True):
+                    uri = p['uri']
+                    d[uri.strip('/')] = uri, True, last_mod
+        return d
+
+    def prune(self) -> list:
+        """
+        Remove hashed versions of registered files left by previous builds from dist_dir and the index, returns
+        the paths removed relative to dist_dir.
+        """
+        _, stale = self._resolve()
+        for rel_path in stale:
+            logger.debug('removing stale file "%s"', rel_path)
+            (self.config.dist_dir / rel_path).unlink(missing_ok=True)
+            del self.files[rel_path]
+        return stale
+
+    def _resolve(self):
+        """
+        Find the file used for each name, returns a dict of names to paths and a list of stale paths.
+        """
+        sources, stale = {}, []
+        for rel_path, (name, _) in self.files.items():
+            other = sources.get(name)
+            if other is not None:
+                rel_path, stale_path = self._resolve_collision(name, other, rel_path)
+                if rel_path in self.registered and stale_path != name:
+                    # a hashed version of a registered file from a previous build
+                    stale.append(stale_path)
+            sources[name] = rel_path
+        return sources, stale
+
+    def _resolve_collision(self, name: str, a: str, b: str):
+        """
+        Decide which of two files with the same name is used, returns (current, stale). Registered names are
+        unique so at most one of the files is registered.
+        """
+        reg_a, reg_b = a in self.registered, b in self.registered
+        if reg_a or reg_b:
+            current, other = (a, b) if reg_a else (b, a)
+            if other == name:
+                logger.warning('"%s" and "%s" both resolve to the path "%s", using "%s"', a, b, name, current)
+            return current, other
+        else:
+            logger.debug('"%s" and "%s" both resolve to "%s", using the most recently modified', a, b, name)
+            if float(self.files[a][1][2]) > float(self.files[b][1][2]):
+                return a, b
+            else:
+                return b, a
 
 
 def resolve_path(path, path_lookup, config):
@@ -1,13 +1,25 @@
 import logging
 import re
-from datetime import datetime
+from datetime import datetime, timezone
+from os.path import normcase
 from pathlib import Path
 from time import time
 from typing import Optional
 
 from pydantic import BaseModel, validator
 
-from .common import RE_URI_NOT_ALLOWED, HarrierProblem, clean_uri, log_complete, norm_path_ref, slugify
+from .cache import BuildManifest, LRUCache, file_key
+from .common import (
+    RE_URI_NOT_ALLOWED,
+    HarrierProblem,
+    clean_uri,
+    log_complete,
+    norm_path_ref,
+    parallel_map,
+    path_match_set,
+    slugify,
+    walk_files,
+)
 from .config import Config
 from .extensions import ExtensionError
 from .frontmatter import parse_front_matter, parse_yaml
@@ -18,6 +30,7 @@ YAML_FILE = {'.yml', '.yaml'}
 MAYBE_RENDER = {'.xml', '.txt'}
 DATE_REGEX = re.compile(r'(\d{4})-(\d{2})-(\d{2})-?(.*)')
 URI_IS_TEMPLATE = re.compile('[{}]')
+PLACEHOLDER_REGEX = re.compile(r'{{ ?(\w+).?}}')
 
 logger = logging.getLogger('harrier.build')
 
@@ -26,58 +39,106 @@ class PlaceHolderError(HarrierProblem):
     pass
 
 
-def build_pages(config: Config):
+def build_pages(config: Config, manifest: BuildManifest = None):
     start = time()
-    pages, files = BuildPages(config).run()
+    pages, files = BuildPages(config, manifest).run()
     log_complete(start, 'pages built', files)
     return pages
 
 
 def content_templates(pages, config):
-    tmp_dir = config.get_tmp_dir()
+    """
+    Set the name of the template used to render each page's content, the renderer loads it from memory.
+    """
     for page in pages:
         if not page['pass_through']:
-            content_template = tmp_dir / 'content' / page['infile'].relative_to(config.pages_dir)
-            if not content_template.parent.exists():
-                content_template.parent.mkdir(parents=True)
-            content_template.write_text(page['content'])
-            page['content_template'] = str(content_template.relative_to(tmp_dir))
+            page['content_template'] = str(Path('content') / page['infile'].relative_to(config.pages_dir))
 
 
 class BuildPages:
-    __slots__ = 'config', 'tmp_dir', 'files', 'template_files'
+    __slots__ = 'config', 'manifest', 'tmp_dir', 'files', 'template_files', 'ignore_dirs'
 
-    def __init__(self, config: Config):
+    def __init__(self, config: Config, manifest: BuildManifest = None):
         self.config = config
+        self.manifest = manifest
+        # directories aren't searched if an ignore glob ending in "*" matches their path with a trailing slash
+        self.ignore_dirs = path_match_set(m for m in config.ignore if m.raw.endswith('*'))
         self.files = 0
         self.template_files = 0
 
     def run(self):
-        paths = sorted(self.config.pages_dir.glob('**/*'), key=lambda p_: (len(p_.parents), str(p_)))
+        entries = list(walk_files(self.config.pages_dir, self._ignore_dir))
+        paths = [Path(entry.path) for entry in entries]
         pages = {}
-        for p in paths:
-            if p.is_file():
-                try:
-                    v = get_page_data(p, config=self.config)
-                except (ExtensionError, PlaceHolderError):
-                    # these are logged directly
-                    raise
-                except Exception:
-                    logger.exception('%s: error building SOM for page', p)
-                    raise
-                if v:
-                    self.files += 1
-                    if not v['pass_through']:
-                        self.template_files += 1
-                    path_ref = v.pop('path_ref')
-                    pages[path_ref] = v
+        for v in self._get_pages_data(paths, entries):
+            if v:
+                self.files += 1
+                if not v['pass_through']:
+                    self.template_files += 1
+                path_ref = v.pop('path_ref')
+                pages[path_ref] = v
+        if self.manifest:
+            self.manifest.prune_pages(paths)
         logger.debug('Built site object model with %d files, %d files to render', self.files, self.template_files)
         return pages, self.files
 
+    def _ignore_dir(self, path: str):
+        # true if every file in the directory would be ignored
+        return self.ignore_dirs(normcase(path[len(str(self.config.pages_dir)) :]) + '/')
+
+    def _get_pages_data(self, paths, entries):
+        """
+        Get data for each path in order, using the manifest where possible and parsing everything else either
+        in this process or across a pool of processes.
+        """
+        if self.manifest is None:
+            return self._parse(paths)
+
+        # DirEntry caches stat results
+        keys = [file_key(entry) for entry in entries]
+        results = [self.manifest.get_page(p, key) for p, key in zip(paths, keys)]
+        to_parse = [i for i, v in enumerate(results) if v is None]
+        for i, v in zip(to_parse, self._parse([paths[i] for i in to_parse])):
+            results[i] = v
+            v and self.manifest.set_page(paths[i], keys[i], v)
+        return results
+
+    def _parse(self, paths):
+        jobs = self.config.jobs
+        if jobs == 1 or len(paths) < 2:
+            return [_get_page_data(p, self.config) for p in paths]
+
+        chunks = parallel_map(_parse_chunk, paths, jobs, _init_build_worker, (self.config,), config=self.config)
+        return [v for chunk in chunks for v in chunk]
+
+
+# set in each worker process by _init_build_worker when building the som in parallel
+WORKER_CONFIG: Config = None
+
+
+def _init_build_worker(config: Config):
+    global WORKER_CONFIG
+    WORKER_CONFIG = config
+
+
+def _parse_chunk(paths):
+    return [_get_page_data(p, WORKER_CONFIG) for p in paths]
+
+
+def _get_page_data(p: Path, config: Config):
+    try:
+        return get_page_data(p, config=config)
+    except (ExtensionError, PlaceHolderError):
+        # these are logged directly
+        raise
+    except Exception:
+        logger.exception('%s: error building SOM for page', p)
+        raise
+
 
 def get_page_data(p, *, config: Config, file_content: str = None, **extra_data):  # noqa: C901 (ignore complexity)
     path_ref = norm_path_ref(p, config.pages_dir)
-    if any(path_match(path_ref) for path_match in config.ignore):
+    if path_match_set(config.ignore)(path_ref):
         return
 
     html_output = p.suffix in OUTPUT_HTML
@@ -104,26 +165,12 @@ def get_page_data(p, *, config: Config, file_content: str = None, **extra_data):
         'created': created,
     }
 
-    regex = re.compile(r'{{ ?(\w+).?}}')
-
-    def _replace(m):
-        return data[m.group(1)]
-
-    def _apply_placeholders(d):
-        if isinstance(d, str) and '{{' in d:
-            return regex.sub(_replace, d)
-        elif isinstance(d, dict):
-            return {k: _apply_placeholders(v) for k, v in d.items()}
-        elif isinstance(d, list):
-            return [_apply_placeholders(v) for v in d]
-        else:
-            return d
-
-    for path_match, defaults in config.defaults.items():
-        if path_match(path_ref):
-            data.update(defaults)
+    default_matches = path_match_set(config.defaults).matches(path_ref)
+    if default_matches:
+        all_defaults = list(config.defaults.values())
+        for i in default_matches:
             try:
-                data = _apply_placeholders(data)
+                placeholder_plan(all_defaults[i]).apply(data)
             except KeyError as e:
                 logger.exception('%s key error applying placeholders: "%s"', p, e)
                 raise PlaceHolderError(f'Placeholder key error "{e}"') from e
@@ -158,23 +205,139 @@ def get_page_data(p, *, config: Config, file_content: str = None, **extra_data):
             raise KeyError(f'missing format variable "{e.args[0]}" for "{uri}"')
 
     data['uri'] = clean_uri(uri, config)
-    for path_match, f in config.extensions.page_modifiers:
-        if path_match(path_ref):
-            try:
-                data = f(data, config=config)
-            except Exception as e:
-                logger.exception('%s error running page extension %s', p, f.__name__)
-                raise ExtensionError(str(e)) from e
-            if not isinstance(data, dict):
-                logger.error('%s extension "%s" did not return a dict', p, f.__name__)
-                raise ExtensionError(f'extension "{f.__name__}" did not return a dict')
-
-    fd = FileData(**data)
-    final_data = fd.dict(exclude={'template'} if pass_through else set())
+    page_modifiers = config.extensions.page_modifiers
+    modifier_matches = path_match_set(path_match for path_match, _ in page_modifiers).matches(path_ref)
+    for i in modifier_matches:
+        f = page_modifiers[i][1]
+        try:
+            data = f(data, config=config)
+        except Exception as e:
+            logger.exception('%s error running page extension %s', p, f.__name__)
+            raise ExtensionError(str(e)) from e
+        if not isinstance(data, dict):
+            logger.error('%s extension "%s" did not return a dict', p, f.__name__)
+            raise ExtensionError(f'extension "{f.__name__}" did not return a dict')
+
+    # data from extensions could be shared between pages, validating with FileData copies it
+    final_data = None if extra_data or modifier_matches else fast_file_data(data)
+    if final_data is None:
+        final_data = FileData(**data).dict()
+    if pass_through:
+        final_data.pop('template', None)
     final_data['pass_through'] = bool(pass_through)
     return final_data
 
 
+class PlaceholderText:
+    __slots__ = ('parts',)
+
+    def __init__(self, parts):
+        # literal text at even indexes, placeholder names at odd indexes
+        self.parts = parts
+
+    def render(self, context: dict) -> str:
+        return ''.join(context[part] if i % 2 else part for i, part in enumerate(self.parts))
+
+
+class PlaceholderPlan:
+    """
+    Defaults for one glob compiled once into the keys which need placeholders substituted and the names they
+    reference, so each page only pays for the substitutions it needs.
+    """
+
+    __slots__ = 'defaults', 'keys', 'names'
+
+    def __init__(self, defaults: dict):
+        self.defaults = defaults
+        self.keys = {}
+        names = {}
+        for k, v in defaults.items():
+            compiled = _compile_placeholders(v, names)
+            # dicts and lists are always rebuilt so each page gets its own copy, as well as strings with placeholders
+            if compiled is not v:
+                self.keys[k] = compiled
+        self.names = list(names)
+
+    def apply(self, data: dict):
+        """
+        Update data with the defaults and substitute placeholders, raises KeyError if a placeholder is missing.
+        """
+        data.update(self.defaults)
+        if self.keys:
+            # placeholders refer to values before substitution, including unsubstituted values from these defaults
+            context = {name: data[name] for name in self.names}
+            for k, v in self.keys.items():
+                data[k] = _substitute(v, context)
+
+
+def _compile_placeholders(v, names: dict):
+    if isinstance(v, str):
+        parts = PLACEHOLDER_REGEX.split(v) if '{{' in v else ()
+        if len(parts) > 1:
+            names.update(dict.fromkeys(parts[1::2]))
+            return PlaceholderText(parts)
+        return v
+    elif isinstance(v, dict):
+        return {k: _compile_placeholders(v_, names) for k, v_ in v.items()}
+    elif isinstance(v, list):
+        return [_compile_placeholders(v_, names) for v_ in v]
+    else:
+        return v
+
+
+def _substitute(v, context: dict):
+    if isinstance(v, PlaceholderText):
+        return v.render(context)
+    elif isinstance(v, dict):
+        return {k: _substitute(v_, context) for k, v_ in v.items()}
+    elif isinstance(v, list):
+        return [_substitute(v_, context) for v_ in v]
+    else:
+        return v
+
+
+# plans are keyed by the id of the defaults dict, and checked against the dict itself in case the id is reused
+PLACEHOLDER_PLANS = LRUCache(256)
+
+
+def placeholder_plan(defaults: dict) -> PlaceholderPlan:
+    plan = PLACEHOLDER_PLANS.get(id(defaults))
+    if plan is None or plan.defaults is not defaults:
+        plan = PlaceholderPlan(defaults)
+        PLACEHOLDER_PLANS.set(id(defaults), plan)
+    return plan
+
+
+def fast_file_data(data: dict) -> Optional[dict]:
+    """
+    Equivalent of FileData(**data).dict() without the cost of pydantic validation, this is possible when every
+    field already has the right type and the uri is valid, which is the case for most pages.
+
+    Returns None if any field needs validating, FileData should then be used to get the same result or error.
+    """
+    infile, created, template = data.get('infile'), data.get('created'), data.get('template', None)
+    if type(created) is float:
+        # a file's mtime, converted to a UTC datetime as pydantic would
+        created = datetime.fromtimestamp(created, tz=timezone.utc)
+    if not (
+        isinstance(infile, Path)
+        and type(data.get('title')) is str
+        and type(data.get('slug')) is str
+        and type(created) is datetime
+        and (template is None or type(template) is str)
+        and _valid_uri(data.get('uri'))
+    ):
+        return None
+    final_data = {k: data[k] for k in FILE_DATA_FIELDS}
+    final_data['created'] = created
+    final_data.update((k, v) for k, v in data.items() if k not in FILE_DATA_FIELDS)
+    return final_data
+
+
+def _valid_uri(uri) -> bool:
+    return type(uri) is str and uri.startswith('/') and not RE_URI_NOT_ALLOWED.search(uri)
+
+
 class FileData(BaseModel):
     infile: Path
     title: str
@@ -195,3 +358,6 @@ class FileData(BaseModel):
 
     class Config:
         extra = 'allow'
+
+
+FILE_DATA_FIELDS = tuple(FileData.model_fields)
@@ -0,0 +1,271 @@
+import hashlib
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Union
+
+from .config import Config
+from .version import VERSION
+
+logger = logging.getLogger('harrier.cache')
+MANIFEST_FILE = 'build_manifest.pickle'
+ASSET_MANIFEST_FILE = 'asset_manifest.pickle'
+DATA_CACHE_FILE = 'data.pickle'
+# fields which don't change the output of a build and therefore shouldn't invalidate the manifest
+CONFIG_EXCLUDE = {
+    'build_time',
+    'extensions',
+    'jobs',
+    'build_cache',
+    'cache_dir',
+    'sync_dist',
+    'copy_threads',
+    'lazy_data',
+}
+
+
+def hash_obj(obj) -> bytes:
+    """
+    Hash an object via its repr, if the repr isn't stable (eg. it includes an id) we'll just do more work than needed.
+    """
+    return hashlib.md5(repr(obj).encode()).digest()
+
+
+def get_config_key(config: Config) -> bytes:
+    h = hashlib.md5(VERSION.encode())
+    h.update(hash_obj({k: v for k, v in config if k not in CONFIG_EXCLUDE}))
+    if config.extensions.path.is_file():
+        h.update(config.extensions.path.read_bytes())
+    return h.digest()
+
+
+def file_key(p: Union[Path, os.DirEntry]):
+    s = p.stat()
+    return s.st_mtime_ns, s.st_size
+
+
+def load_pickle(path: Path):
+    """
+    Load a manifest or cache saved with save_pickle, returns None if it doesn't exist or can't be loaded.
+
+    "harrier build" saves manifests and caches to the cache directory between builds, "harrier dev" keeps them
+    in memory.
+    """
+    if not path.exists():
+        logger.debug('"%s" not found', path)
+        return None
+    try:
+        return pickle.loads(path.read_bytes())
+    except Exception as e:
+        logger.warning('error loading "%s", ignoring it: %s', path, e)
+        return None
+
+
+def save_pickle(path: Path, obj):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(pickle.dumps(obj))
+
+
+class BuildManifest:
+    """
+    Record of a build used by the next build to skip parsing, rendering and writing pages whose inputs haven't
+    changed.
+    """
+
+    __slots__ = 'path', 'config_key', 'pages', 'outputs', 'deps', 'render_keys', 'outfiles'
+
+    def __init__(self, path: Optional[Path], config_key: bytes):
+        self.path = path
+        self.config_key = config_key
+        # infile: (file key, pickled page data)
+        self.pages = {}
+        # infile: hash of the rendered page or mtime of the copied file, equivalent to the dev build_cache
+        self.outputs = {}
+        # infile: templates, pages and data used when the page was last rendered
+        self.deps = {}
+        # path_ref: hash of the page's inputs when it was last rendered
+        self.render_keys = {}
+        # path_ref: outfile, used to remove outputs of pages which no longer exist
+        self.outfiles = {}
+
+    @classmethod
+    def load(cls, config: Config) -> 'BuildManifest':
+        manifest = cls(config.get_cache_dir() / MANIFEST_FILE, get_config_key(config))
+        data = load_pickle(manifest.path)
+        if data is None:
+            return manifest
+
+        if data['config_key'] == manifest.config_key:
+            manifest.pages = data['pages']
+            manifest.outputs = data['outputs']
+            manifest.deps = data['deps']
+            manifest.render_keys = data['render_keys']
+            manifest.outfiles = data['outfiles']
+            logger.debug('loaded build manifest with %d pages', len(manifest.pages))
+        else:
+            # outfiles are also ignored as dist_dir might have changed, stale outputs are removed by pruning dist_dir
+            logger.debug('config or extensions changed, ignoring build manifest')
+        return manifest
+
+    def save(self):
+        save_pickle(self.path, {k: getattr(self, k) for k in self.__slots__ if k != 'path'})
+
+    def get_page(self, p: Path, key):
+        """
+        Get page data from the last build if the file hasn't changed, otherwise None.
+        """
+        v = self.pages.get(p)
+        if v and v[0] == key:
+            return pickle.loads(v[1])
+
+    def set_page(self, p: Path, key, data):
+        # data is pickled so later modifications to the som (eg. by extensions) don't leak into the manifest
+        self.pages[p] = key, pickle.dumps(data)
+
+    def prune_pages(self, paths):
+        paths = set(paths)
+        self.pages = {p: v for p, v in self.pages.items() if p in paths}
+
+
+class AssetManifest:
+    """
+    Record of the theme assets copied to dist_dir, used so only new or changed assets are hashed and copied and
+    the outputs of deleted assets are removed.
+    """
+
+    __slots__ = 'path', 'config_key', 'assets'
+
+    def __init__(self, path: Optional[Path], config_key: bytes):
+        self.path = path
+        self.config_key = config_key
+        # in_path: (file key, content hash, out_path)
+        self.assets = {}
+
+    @classmethod
+    def load(cls, config: Config) -> 'AssetManifest':
+        manifest = cls(config.get_cache_dir() / ASSET_MANIFEST_FILE, get_config_key(config))
+        data = load_pickle(manifest.path)
+        if data is None:
+            return manifest
+
+        config_key, manifest.config_key = manifest.config_key, data['config_key']
+        manifest.assets = data['assets']
+        manifest.set_config_key(config_key)
+        logger.debug('loaded asset manifest with %d assets', len(manifest.assets))
+        return manifest
+
+    def set_config_key(self, config_key: bytes):
+        """
+        If config or extensions have changed every asset needs copying again, outputs are kept so they're
+        removed or replaced like the output of a changed asset.
+        """
+        if config_key != self.config_key:
+            self.config_key = config_key
+            self.assets = {k: (None, None, v[2]) for k, v in self.assets.items()}
+
+    def save(self):
+        save_pickle(self.path, {'config_key': self.config_key, 'assets': self.assets})
+
+
+class DataCache:
+    """
+    Parsed data files, used so only new or changed data files are parsed. Files are unchanged if their file key is
+    the same or, failing that, their content hash.
+    """
+
+    __slots__ = 'path', 'files'
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        # path: (file key, content hash, pickled data)
+        self.files = {}
+
+    @classmethod
+    def load(cls, config: Config) -> 'DataCache':
+        cache = cls(config.get_cache_dir() / DATA_CACHE_FILE)
+        files = load_pickle(cache.path)
+        if files is not None:
+            cache.files = files
+            logger.debug('loaded data cache with %d files', len(cache.files))
+        return cache
+
+    def save(self):
+        save_pickle(self.path, self.files)
+
+    def get(self, p: Path, key, get_hash):
+        """
+        Get the data parsed from a file if it hasn't changed, otherwise None.
+        """
+        v = self.files.get(p)
+        if not v:
+            return None
+        elif v[0] != key:
+            # the file's mtime can change without its content changing, eg. when switching git branches
+            content_hash = get_hash()
+            if content_hash != v[1]:
+                return None
+            self.files[p] = key, content_hash, v[2]
+        return pickle.loads(v[2])
+
+    def set(self, p: Path, key, content_hash: bytes, data):
+        # data is pickled so later modifications to the som (eg. by extensions) don't leak into the cache
+        self.files[p] = key, content_hash, pickle.dumps(data)
+
+    def prune(self, paths):
+        paths = set(paths)
+        self.files = {p: v for p, v in self.files.items() if p in paths}
+
+
+class LRUCache:
+    """
+    Cache which discards the least recently used entries once it holds more than maxsize. If enabled with
+    track_new, entries added since the last call to pop_new are recorded so worker processes can send them back
+    to the main process.
+    """
+
+    __slots__ = 'maxsize', 'data', 'new'
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.new = None
+
+    def get(self, key):
+        try:
+            value = self.data[key]
+        except KeyError:
+            return None
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.data[key] = value
+        self.data.move_to_end(key)
+        if self.new is not None:
+            self.new[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def update(self, items: dict):
+        for k, v in items.items():
+            self.set(k, v)
+
+    def track_new(self):
+        self.new = {}
+
+    def pop_new(self) -> dict:
+        new, self.new = self.new, {}
+        return new
+
+    def load(self, path: Path):
+        data = load_pickle(path)
+        if data is not None:
+            self.update(data)
+
+    def save(self, path: Path):
+        save_pickle(path, self.data)
+
+    def __len__(self):
+        return len(self.data)
@@ -14,6 +14,7 @@ from .version import VERSION
 steps_help = 'Build steps to run, multiple values allowed, default: all.'
 dev_help = 'Whether to build in development or production mode, default: production.'
 verbose_help = 'Enable verbose output.'
+jobs_help = 'Number of processes to use when building and rendering pages, default: "jobs" from config or 1.'
 logger = logging.getLogger('harrier')
 
 
@@ -30,8 +31,9 @@ def cli():
 @click.argument('path', type=click.Path(exists=True), required=False, default='.')
 @click.option('--steps', '-s', multiple=True, type=click.Choice(main.ALL_STEPS), help=steps_help)
 @click.option('-d/-p', '--dev/--prod', 'dev_mode', default=None, help=dev_help)
+@click.option('-j', '--jobs', type=click.IntRange(min=1), default=None, help=jobs_help)
 @click.option('-v/-q', '--verbose/--quiet', 'verbose', default=None, help=verbose_help)
-def build(path, dev_mode, steps, verbose):
+def build(path, dev_mode, steps, jobs, verbose):
     """
     build the site
     """
@@ -41,7 +43,7 @@ def build(path, dev_mode, steps, verbose):
         mode = Mode.development if dev_mode else Mode.production
 
     try:
-        main.build(path, set(steps), mode)
+        main.build(path, set(steps), mode, jobs)
     except (HarrierProblem, ValidationError, GrablibError) as e:
         msg = 'Error: {}'
         if not verbose:
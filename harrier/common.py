@@ -1,15 +1,24 @@
 import logging.config
+import multiprocessing
+import os
 import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from fnmatch import translate
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener
 from os.path import normcase
 from pathlib import Path
 from time import time
+from typing import List, Tuple
 
 import click
 from ruamel.yaml import YAML
 
+# uses ruamel.yaml.clib's C parser when it's installed, see frontmatter.load_simple_yaml for the fastest case
 yaml = YAML(typ='safe')
 completed_logger = logging.getLogger('harrier.completed')
+logger = logging.getLogger('harrier.common')
 
 
 class HarrierProblem(RuntimeError):
@@ -20,6 +29,65 @@ def log_complete(start, description, items):
     completed_logger.info('%6s %20s %0.3fs', items, description, time() - start)
 
 
+class LogForwarder:
+    """
+    Used with QueueListener to handle log records from worker processes as if they were logged in this process.
+    """
+
+    level = logging.NOTSET
+
+    @staticmethod
+    def handle(record):
+        logging.getLogger(record.name).handle(record)
+
+
+def _init_pool_worker(log_queue, level, initializer, initargs, config):
+    root = logging.getLogger()
+    for logger in [root, *root.manager.loggerDict.values()]:
+        if isinstance(logger, logging.Logger):
+            logger.handlers.clear()
+            logger.propagate = True
+    root.addHandler(QueueHandler(log_queue))
+    # required when workers are spawned rather than forked and therefore don't inherit logging setup
+    logging.getLogger('harrier').setLevel(level)
+    if config is not None:
+        # extensions aren't pickled, they need to be loaded again in the worker
+        config.extensions.load()
+    if initializer:
+        initializer(*initargs)
+
+
+@contextmanager
+def process_pool(jobs: int, initializer=None, *initargs, config=None):
+    """
+    ProcessPoolExecutor whose workers send their log records back to this process, so errors are reported
+    the same way as when running in a single process. If config is set its extensions are loaded in each worker.
+    """
+    log_queue = multiprocessing.Queue()
+    listener = QueueListener(log_queue, LogForwarder())
+    listener.start()
+    level = logging.getLogger('harrier').getEffectiveLevel()
+    try:
+        init_args = log_queue, level, initializer, initargs, config
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_pool_worker, initargs=init_args) as executor:
+            yield executor
+    finally:
+        listener.stop()
+
+
+def parallel_map(func, items: list, jobs: int, initializer=None, initargs=(), config=None) -> list:
+    """
+    Split items into chunks and call func with each chunk across a pool of processes, returns the result for each
+    chunk in order. Chunks are deterministic so results are the same as a serial run, there are around four per
+    process so work is spread evenly when some items take longer than others.
+    """
+    chunk_size = -(-len(items) // (jobs * 4))
+    chunks = [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+    logger.debug('%s: %d items in %d chunks with %d processes', func.__name__, len(items), len(chunks), jobs)
+    with process_pool(jobs, initializer, *initargs, config=config) as executor:
+        return list(executor.map(func, chunks))
+
+
 class PathMatch:
     __slots__ = 'raw', '_regex'
 
@@ -47,6 +115,134 @@ class PathMatch:
         return cls(value)
 
 
+class PathMatchSet:
+    """
+    Many globs compiled into one regex so a path is tested against all of them in a single match.
+
+    Each glob is wrapped in an optional lookahead with its own group, so one match tells us every glob which matched
+    in order, a plain alternation is used first to quickly rule out paths which don't match any glob.
+    """
+
+    __slots__ = 'raw', '_any', '_all', '_groups'
+
+    def __init__(self, globs: Tuple[str, ...]):
+        self.raw = globs
+        patterns = [translate(normcase(g)) for g in globs]
+        self._any = patterns and re.compile('|'.join(f'(?:{p})' for p in patterns))
+        self._all = re.compile(''.join(f'(?:(?=(?P<m{i}>{p}))|)' for i, p in enumerate(patterns)))
+        self._groups = [self._all.groupindex[f'm{i}'] for i in range(len(patterns))]
+
+    def __call__(self, path: str) -> bool:
+        """
+        Whether any of the globs match path.
+        """
+        return bool(self._any and self._any.match(path))
+
+    def matches(self, path: str) -> List[int]:
+        """
+        Indexes of all globs which match path, in the order the globs were given.
+        """
+        if not self(path):
+            return []
+        m = self._all.match(path)
+        return [i for i, g in enumerate(self._groups) if m.start(g) != -1]
+
+    def __repr__(self):
+        return f'<PathMatchSet {self.raw!r}>'
+
+
+def path_match_set(path_matches) -> PathMatchSet:
+    """
+    Compiled PathMatchSet for globs or PathMatch instances, sets are cached so each is only compiled once.
+    """
+    return _compile_path_match_set(tuple(getattr(m, 'raw', m) for m in path_matches))
+
+
+@lru_cache(maxsize=256)
+def _compile_path_match_set(globs: Tuple[str, ...]) -> PathMatchSet:
+    return PathMatchSet(globs)
+
+
+ALL = '*'
+
+
+class TrackedDict(dict):
+    """
+    dict which records the keys accessed while rendering a page, so the page only needs rendering again
+    when one of those values changes. Iterating over the dict makes the page depend on every value.
+    """
+
+    __slots__ = '_name', '_accessed'
+
+    def __init__(self, name, *args):
+        super().__init__(*args)
+        self._name = name
+        self._accessed = None
+
+    def _record(self, key):
+        if self._accessed is not None:
+            self._accessed.add((self._name, key))
+
+    def __getitem__(self, key):
+        self._record(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self._record(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self._record(key)
+        return super().get(key, default)
+
+    def __iter__(self):
+        self._record(ALL)
+        return super().__iter__()
+
+    def __len__(self):
+        self._record(ALL)
+        return super().__len__()
+
+    def keys(self):
+        self._record(ALL)
+        return super().keys()
+
+    def values(self):
+        self._record(ALL)
+        return super().values()
+
+    def items(self):
+        self._record(ALL)
+        return super().items()
+
+
+def walk_files(directory: Path, skip_dir=None):
+    """
+    Find files in directory and its subdirectories using os.scandir, in the same order as sorting the files from
+    directory.glob('**/*') by depth then path. DirEntry objects are yielded, their stat results are cached.
+
+    skip_dir is called with the path of each subdirectory, if it returns true the subdirectory isn't searched.
+    """
+    level = [str(directory)]
+    while level:
+        files, next_level = [], []
+        for d in level:
+            try:
+                with os.scandir(d) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not (skip_dir and skip_dir(entry.path)):
+                                next_level.append(entry.path)
+                        elif entry.is_file():
+                            files.append(entry)
+            except PermissionError:
+                # as with glob, directories which can't be read are ignored
+                pass
+        files.sort(key=lambda e: e.path)
+        yield from files
+        level = next_level
+
+
 def norm_path_ref(p: Path, rel: Path):
     return '/' + normcase(str(p.relative_to(rel)))
 
@@ -7,7 +7,7 @@ from itertools import product
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Union
 
-from pydantic import BaseModel, ConfigDict, Extra, field_validator
+from pydantic import BaseModel, ConfigDict, Extra, PositiveInt, field_validator
 from ruamel.yaml import YAMLError
 
 from .common import HarrierProblem, PathMatch, yaml
@@ -23,6 +23,13 @@ class Mode(str, Enum):
     production = 'production'
 
 
+class LinkMode(str, Enum):
+    copy = 'copy'
+    hardlink = 'hardlink'
+    reflink = 'reflink'
+    symlink = 'symlink'
+
+
 class WebpackConfig(BaseModel):
     cli: Path = None
     entry: Optional[Path] = 'js/index.js'
@@ -49,6 +56,19 @@ class Config(BaseModel, extra=Extra.allow):
     dist_dir_sass: Path = Path('theme')
     dist_dir_assets: Path = Path('.')
     tmp_dir: Union[Path, None] = None
+    # keep dist_dir between builds, only write files whose content has changed and remove stale files at the end
+    sync_dist: bool = False
+    # how pass-through pages and theme assets are put in dist_dir, if linking fails files are copied
+    link_mode: LinkMode = LinkMode.copy
+    # number of threads used to write and copy files to dist_dir
+    copy_threads: PositiveInt = 4
+    # number of processes used to build the som and render pages, 1 means everything happens in the main process
+    jobs: PositiveInt = 1
+    # persist a manifest between builds so unchanged pages aren't parsed, rendered or written again
+    build_cache: bool = False
+    cache_dir: Union[Path, None] = None
+    # data files are only read and parsed when they're first used, rather than all being loaded at the start
+    lazy_data: bool = False
 
     download: Dict[str, Any] = {}
     download_aliases: Dict[str, str] = {}
@@ -59,6 +79,8 @@ class Config(BaseModel, extra=Extra.allow):
     defaults: Dict[PathMatch, Dict[str, Any]] = {}
     ignore: List[PathMatch] = []
     no_hash: List[PathMatch] = ['/favicon.???']
+    # csv files in data_dir matching these globs are loaded as a CsvTable rather than a list of dicts
+    compact_csv: List[PathMatch] = []
 
     webpack: WebpackConfig = WebpackConfig()
     build_time: Union[datetime, None] = None
@@ -71,6 +93,12 @@ class Config(BaseModel, extra=Extra.allow):
     def resolve_relative_paths(cls, v, info):
         return (info.data['source_dir'] / v).resolve()
 
+    @field_validator('cache_dir')
+    def resolve_cache_dir(cls, v, info):
+        if v and not v.is_absolute():
+            v = (info.data['source_dir'] / v).resolve()
+        return v
+
     @field_validator('pages_dir')
     def is_dir(cls, v, info):
         if not v.exists():
@@ -153,6 +181,13 @@ class Config(BaseModel, extra=Extra.allow):
             path_hash = hashlib.md5(b'%s' % self.source_dir).hexdigest()
             return Path(tempfile.gettempdir()) / f'harrier-{path_hash}'
 
+    def get_cache_dir(self) -> Path:
+        if self.cache_dir:
+            return self.cache_dir
+        else:
+            path_hash = hashlib.md5(b'%s' % self.source_dir).hexdigest()
+            return Path(tempfile.gettempdir()) / f'harrier-cache-{path_hash}'
+
     model_config = ConfigDict(validate_default=True, arbitrary_types_allowed=True)
 
 
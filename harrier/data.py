@@ -2,60 +2,260 @@ import csv
 import json
 import logging
 import re
+from collections.abc import Mapping, Sequence
+from functools import partial
 from pathlib import Path
 from time import time
+from typing import Optional
 
 from ruamel.yaml import YAMLError
 
-from .common import HarrierProblem, log_complete, yaml
+from .cache import DataCache, LRUCache, file_key
+from .common import (
+    HarrierProblem,
+    TrackedDict,
+    log_complete,
+    norm_path_ref,
+    parallel_map,
+    path_match_set,
+    walk_files,
+    yaml,
+)
 from .config import Config
+from .output import hash_file
 
 logger = logging.getLogger('harrier.data')
 csv_dialect = csv.excel
 csv_dialect.skipinitialspace = True
+# maximum number of files kept in memory after they're parsed with lazy_data
+LAZY_DATA_CACHE_SIZE = 32
 
 
 def simplify(key):
     return re.sub(r'\W', '', re.sub(r'[\- ]', '_', key))
 
 
-def load_data(config: Config):
+def load_data(config: Config, cache: DataCache = None):
     start = time()
     d = config.data_dir
     if not d.is_dir():
         return None
-    ext_lookup = {
-        '.json': read_json,
-        '.csv': read_csv,
-        '.yaml': read_yaml,
-        '.yml': read_yaml,
-    }
-    data = {}
+
+    # files are found with one walk, then sorted by extension as the order of READERS decides which file is used
+    # when two have the same key
+    suffixes = list(READERS)
+    entries = [e for e in walk_files(d) if Path(e.name).suffix in READERS]
+    entries.sort(key=lambda e: suffixes.index(Path(e.name).suffix))
+
+    lazy = config.lazy_data
+    used, file_keys, to_load, data_keys = set(), set(), [], []
+    for entry in entries:
+        p = Path(entry.path)
+        parts = data_key(p, d)
+        # lazy files can't contain the data of other files
+        if parts in used or (lazy and any(parts[:i] in file_keys for i in range(1, len(parts)))):
+            logger.warning('duplicate data key "%s", ignoring data in "%s", please rename', '.'.join(parts), p)
+            continue
+        used.update(parts[:i] for i in range(1, len(parts) + 1))
+        file_keys.add(parts)
+        logger.debug('reading data from "%s" as "%s"', p, parts[-1])
+        to_load.append((p, entry, get_reader(p, config)))
+        data_keys.append(parts)
+
+    if lazy:
+        data = LazyData()
+        values = [DataFile(p, file_key(entry), reader) for p, entry, reader in to_load]
+    else:
+        data = {}
+        values = _load_files(to_load, cache, config.jobs)
+        cache and cache.prune(p for p, _, _ in to_load)
+
     count = 0
-    for ext in ext_lookup:
-        for p in d.glob(f'**/*{ext}'):
-            parts = [simplify(k) for k in p.relative_to(d).with_suffix('').parts]
-            *parents, key = parts
-            data_ = data
-            for parent in parents:
-                if parent not in data_:
-                    data_[parent] = {}
-                data_ = data_[parent]
+    for (p, _, _), parts, value in zip(to_load, data_keys, values):
+        *parents, key = parts
+        data_ = data
+        for parent in parents:
+            if parent not in data_:
+                data_[parent] = LazyData(cache=data._cache) if lazy else {}
+            data_ = data_[parent]
 
-            if key in data_:
-                logger.warning('duplicate data key "%s", ignoring data in "%s", please rename', '.'.join(parts), p)
-                continue
-            logger.debug('reading data from "%s" as "%s"', p, key)
-            try:
-                data_[key] = ext_lookup[p.suffix](p)
-            except (ValueError, YAMLError) as e:
-                logger.error('error parsing file %s: %s', p, e)
-                raise HarrierProblem(f'error reading {p} {e.__class__.__name__}: {e}') from e
-            count += 1
+        if key in data_:
+            logger.warning('duplicate data key "%s", ignoring data in "%s", please rename', '.'.join(parts), p)
+            continue
+        data_[key] = value
+        count += 1
     log_complete(start, 'data loaded', count)
     return data
 
 
+def update_data(config: Config, data: dict, paths, cache: DataCache) -> bool:
+    """
+    Update data in place with the content of modified data files, only those files are parsed.
+
+    Returns False if the changes can't be applied this way, eg. files have been created or deleted, in which case
+    load_data should be used.
+    """
+    paths = list(paths)
+    if isinstance(data, LazyData) or not all(p in cache.files and p.is_file() for p in paths):
+        # lazy data isn't parsed when it's loaded so loading it again is quick
+        return False
+
+    for p, value in zip(paths, _load_files([(p, p, get_reader(p, config)) for p in paths], cache, 1)):
+        *parents, key = data_key(p, config.data_dir)
+        data_ = data
+        try:
+            for parent in parents:
+                data_ = data_[parent]
+        except (KeyError, TypeError):
+            # data has been modified, eg. by an extension
+            return False
+        data_[key] = value
+    return True
+
+
+class DataFile:
+    """
+    A data file which hasn't been parsed, used as the value of its key in LazyData.
+    """
+
+    __slots__ = 'path', 'key', 'reader'
+
+    def __init__(self, path: Path, key, reader):
+        self.path = path
+        self.key = key
+        self.reader = reader
+
+    def __repr__(self):
+        # used to hash the dependencies of pages, the file key means the hash changes when the file changes
+        return f'<DataFile "{self.path}" {self.key}>'
+
+
+class LazyData(TrackedDict):
+    """
+    Data where each file is read and parsed when its key is first accessed, rather than when data is loaded.
+    Parsed files are kept in a cache of limited size shared by all directories, files evicted from the cache are
+    parsed again when next accessed.
+
+    Use load_all(data) to get all data as a normal dict, eg. from an extension which needs everything. Attributes
+    and helpers are private so they don't hide data files with the same name in templates.
+    """
+
+    __slots__ = ('_cache',)
+
+    def __init__(self, data=(), cache: LRUCache = None):
+        super().__init__('data', data)
+        self._cache = LRUCache(LAZY_DATA_CACHE_SIZE) if cache is None else cache
+
+    def _load(self, v):
+        if not isinstance(v, DataFile):
+            return v
+        cache_key = v.path, v.key
+        value = self._cache.get(cache_key)
+        if value is None:
+            logger.debug('reading data from "%s"', v.path)
+            value = read_file(v.path, v.reader)
+            self._cache.set(cache_key, value)
+        return value
+
+    def __getitem__(self, key):
+        return self._load(super().__getitem__(key))
+
+    def get(self, key, default=None):
+        return self._load(super().get(key, default))
+
+    def values(self):
+        return [self._load(v) for v in super().values()]
+
+    def items(self):
+        return [(k, self._load(v)) for k, v in super().items()]
+
+    def pop(self, key, *args):
+        return self._load(super().pop(key, *args))
+
+    def copy(self):
+        return LazyData(dict.items(self), cache=self._cache)
+
+    def __eq__(self, other):
+        return load_all(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __reduce__(self):
+        # the default would parse every file, pickle keeps the cache shared by every directory
+        return LazyData, (dict(dict.items(self)), self._cache)
+
+
+def load_value(data: dict, v):
+    """
+    Parse a value got directly from the underlying dict of LazyData, eg. with dict.items(), unless it's already
+    loaded. Values from any other dict are returned unchanged.
+    """
+    return data._load(v) if isinstance(data, LazyData) else v
+
+
+def load_all(data: dict) -> dict:
+    """
+    Get data as a normal dict, with LazyData every file is parsed.
+    """
+    if not isinstance(data, LazyData):
+        return data
+    return {k: load_all(v) if isinstance(v, LazyData) else data._load(v) for k, v in dict.items(data)}
+
+
+def data_key(p: Path, data_dir: Path):
+    return tuple(simplify(k) for k in p.relative_to(data_dir).with_suffix('').parts)
+
+
+def _load_files(to_load, cache: Optional[DataCache], jobs: int):
+    """
+    Get data for each path in order, using the cache where possible and parsing everything else either in
+    this process or across a pool of processes.
+    """
+    if cache is None:
+        return _parse([(p, reader) for p, _, reader in to_load], jobs)
+
+    # file_key works with both paths and DirEntry objects which cache stat results
+    keys = [(file_key(f), reader.__name__) for _, f, reader in to_load]
+    values = [cache.get(p, key, partial(_content_hash, p, r)) for (p, _, r), key in zip(to_load, keys)]
+    to_parse = [i for i, v in enumerate(values) if v is None]
+    for i, v in zip(to_parse, _parse([(to_load[i][0], to_load[i][2]) for i in to_parse], jobs)):
+        p, _, reader = to_load[i]
+        values[i] = v
+        cache.set(p, keys[i], _content_hash(p, reader), v)
+    return values
+
+
+def _content_hash(p: Path, reader) -> bytes:
+    # the reader is included as the data is different if a csv file is read with read_csv_compact
+    return hash_file(p) + reader.__name__.encode()
+
+
+def _parse(files, jobs: int):
+    if jobs == 1 or len(files) < 2:
+        return _parse_chunk(files)
+
+    return [v for chunk in parallel_map(_parse_chunk, files, jobs) for v in chunk]
+
+
+def _parse_chunk(files):
+    return [read_file(p, reader) for p, reader in files]
+
+
+def get_reader(p: Path, config: Config):
+    if p.suffix == '.csv' and path_match_set(config.compact_csv)(norm_path_ref(p, config.data_dir)):
+        return read_csv_compact
+    return READERS[p.suffix]
+
+
+def read_file(p: Path, reader=None):
+    try:
+        return (reader or READERS[p.suffix])(p)
+    except (ValueError, YAMLError) as e:
+        logger.error('error parsing file %s: %s', p, e)
+        raise HarrierProblem(f'error reading {p} {e.__class__.__name__}: {e}') from e
+
+
 def read_json(p: Path):
     with p.open() as f:
         return json.load(f)
@@ -67,5 +267,81 @@ def read_csv(p: Path):
         return [dict(r) for r in reader]
 
 
+def read_csv_compact(p: Path):
+    with p.open(newline='') as f:
+        reader = csv.reader(f, dialect=csv_dialect)
+        header = next(reader, [])
+        # as with DictReader, blank rows are skipped and short rows are filled with "other"
+        padding = ('other',) * len(header)
+        rows = [tuple(r) + padding[len(r) :] if len(r) < len(header) else tuple(r) for r in reader if r]
+    return CsvTable(header, rows)
+
+
+class CsvTable(Sequence):
+    """
+    Compact alternative to a list of dicts for csv data: the header is shared and each row is a tuple. CsvRow
+    mappings are created as rows are accessed, so iterating over the table doesn't build a dict for every row.
+    """
+
+    __slots__ = 'header', 'index', 'rows'
+
+    def __init__(self, header, rows: list):
+        self.header = tuple(header)
+        self.index = {k: i for i, k in enumerate(self.header)}
+        self.rows = rows
+
+    def column(self, name) -> list:
+        i = self.index[name]
+        return [row[i] for row in self.rows]
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return CsvTable(self.header, self.rows[item])
+        return CsvRow(self, self.rows[item])
+
+    def __iter__(self):
+        for row in self.rows:
+            yield CsvRow(self, row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __eq__(self, other):
+        if isinstance(other, CsvTable):
+            return self.header == other.header and self.rows == other.rows
+        return list(self) == other
+
+    def __repr__(self):
+        return f'CsvTable({self.header!r}, {self.rows!r})'
+
+
+class CsvRow(Mapping):
+    __slots__ = '_table', '_values'
+
+    def __init__(self, table: CsvTable, values: tuple):
+        self._table = table
+        self._values = values
+
+    def __getitem__(self, key):
+        return self._values[self._table.index[key]]
+
+    def __iter__(self):
+        return iter(self._table.header)
+
+    def __len__(self):
+        return len(self._table.header)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
 def read_yaml(p: Path):
     return yaml.load(p.read_text())
+
+
+READERS = {
+    '.json': read_json,
+    '.csv': read_csv,
+    '.yaml': read_yaml,
+    '.yml': read_yaml,
+}
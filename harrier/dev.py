@@ -13,13 +13,14 @@ from aiohttp_devtools.runserver import serve_static
 from pydantic import BaseModel
 from watchfiles import Change, DefaultFilter, awatch
 
-from .assets import copy_assets, get_path_lookup, run_grablib, start_webpack_watch
+from .assets import PathIndex, copy_assets, run_grablib, start_webpack_watch
 from .build import build_pages, content_templates, get_page_data
+from .cache import AssetManifest, BuildManifest, DataCache, get_config_key
 from .common import HarrierProblem, log_complete, setup_logging
 from .config import Config, get_config
-from .data import load_data
+from .data import load_data, update_data
 from .extensions import apply_modifiers, apply_page_generator
-from .render import get_outfile, render_pages
+from .render import TrackingEnvironment, create_environment, get_outfile, render_pages
 
 HOST = '0.0.0.0'
 logger = logging.getLogger('harrier.dev')
@@ -50,9 +51,13 @@ class Server:
 
 # CONFIG will set on the child process before update_site is called using set_config
 CONFIG: Config = None
-# SOM and BUILD_CACHE will only be set after the fork in the child process created by ProcessPoolExecutor
+# SOM and MANIFEST will only be set after the fork in the child process created by ProcessPoolExecutor
 SOM = None
-BUILD_CACHE = {}
+MANIFEST: BuildManifest = None
+ASSET_MANIFEST: AssetManifest = None
+PATH_INDEX: PathIndex = None
+DATA_CACHE: DataCache = None
+ENV: TrackingEnvironment = None
 FIRST_BUILD = '__FB__'
 
 
@@ -68,15 +73,31 @@ def set_config(main_config: Config, verbose: bool = False) -> None:
 class UpdateArgs(BaseModel):
     config_path: str
     pages: set = FIRST_BUILD
+    # assets: every asset is checked, changed_assets: only these paths are checked
     assets: bool = False
+    changed_assets: set = set()
     sass: bool = False
     templates: bool = False
+    # data: all data is loaded, changed_data: only these files have changed
     data: bool = False
+    changed_data: set = set()
     extensions: bool = False
     update_config: bool = False
 
     def build_required(self):
-        return any([self.pages, self.assets, self.sass, self.templates, self.data, self.extensions, self.update_config])
+        return any(
+            [
+                self.pages,
+                self.assets,
+                self.changed_assets,
+                self.sass,
+                self.templates,
+                self.data,
+                self.changed_data,
+                self.extensions,
+                self.update_config,
+            ]
+        )
 
 
 def update_site(args: UpdateArgs):  # noqa: C901 (ignore complexity)
@@ -91,10 +112,10 @@ def update_site(args: UpdateArgs):  # noqa: C901 (ignore complexity)
     else:
         msg = [
             args.pages and f'{len(args.pages)} pages changed',
-            args.assets and 'assets changed',
+            (args.assets or args.changed_assets) and 'assets changed',
             args.sass and 'sass changed',
             args.templates and 'templates changed',
-            args.data and 'data changed',
+            (args.data or args.changed_data) and 'data changed',
             args.extensions and 'extensions changed',
             args.update_config and 'config changed',
         ]
@@ -113,19 +134,21 @@ def update_site(args: UpdateArgs):  # noqa: C901 (ignore complexity)
         else:
             config = CONFIG
         config.build_time = datetime.utcnow()
-        if args.assets:
-            copy_assets(config)
+        if args.assets or args.changed_assets or PATH_INDEX is None:
+            _copy_assets(config, args)
             args.templates = True  # force re-render as pages might have changed
             args.sass = True  # in case paths changed as used by resolve_url in sass
+        PATH_INDEX.config = config
         if args.sass:
-            run_grablib(config)
+            run_grablib(config, PATH_INDEX)
+            PATH_INDEX.scan(config.dist_dir / config.dist_dir_sass)
             args.templates = True  # force re-render as pages might have changed
 
         if full_build:
             pages = build_pages(config)
             SOM = dict(
                 pages=pages,
-                data=load_data(config),
+                data=_load_data(config),
                 config=config,
             )
             apply_page_generator(SOM, config)
@@ -133,24 +156,22 @@ def update_site(args: UpdateArgs):  # noqa: C901 (ignore complexity)
             content_templates(SOM['pages'].values(), config)
         else:
             SOM['config'] = config
-            if args.data:
+            if args.data or args.changed_data:
                 start = time()
-                SOM['data'] = load_data(config)
-                log_complete(start, 'data updated', 1)
+                if args.data or not update_data(config, SOM['data'], args.changed_data, DATA_CACHE):
+                    SOM['data'] = _load_data(config)
+                log_complete(start, 'data updated', len(args.changed_data) or 1)
                 args.templates = True
 
             to_update = set()
             if args.pages:
                 start = time()
-                tmp_dir = config.get_tmp_dir()
                 for change, path in args.pages:
                     rel_path = '/' + str(path.relative_to(config.pages_dir))
                     if change == Change.deleted:
                         page = SOM['pages'][rel_path]
                         outfile = get_outfile(page, config)
                         outfile.unlink()
-                        if 'content_template' in page:
-                            (tmp_dir / page['content_template']).unlink()
                         SOM['pages'].pop(rel_path)
                     else:
                         v = get_page_data(path, config=config)
@@ -166,10 +187,24 @@ def update_site(args: UpdateArgs):  # noqa: C901 (ignore complexity)
             SOM = apply_modifiers(SOM, config.extensions.som_modifiers)
             content_templates([SOM['pages'][k] for k in SOM['pages'] if k in to_update], config)
 
-        SOM['path_lookup'] = get_path_lookup(config, SOM['pages'])
+        if config.webpack and config.webpack.run:
+            # webpack is running in watch mode so its output could have changed at any time
+            wp_dir = config.webpack.output_path
+            PATH_INDEX.scan(wp_dir if not config.webpack.config and is_within(wp_dir, config.dist_dir) else None)
+        PATH_INDEX.prune()
+        SOM['path_lookup'] = PATH_INDEX.lookup(SOM['pages'])
         if args.templates:
-            global BUILD_CACHE
-            BUILD_CACHE = render_pages(config, SOM, build_cache=BUILD_CACHE)
+            global MANIFEST, ENV
+            # pages are only rendered if they, or the templates they use, have changed since the last build
+            config_key = get_config_key(config)
+            if MANIFEST is None:
+                MANIFEST = BuildManifest(None, config_key)
+            if ENV is None or MANIFEST.config_key != config_key:
+                # the environment is kept unless config or extensions change, so templates are only compiled again
+                # when they're modified
+                ENV = create_environment(config)
+            MANIFEST.config_key = config_key
+            render_pages(config, SOM, manifest=MANIFEST, env=ENV)
     except HarrierProblem as e:
         logger.debug('error during build %s %s %s', traceback.format_exc(), e.__class__.__name__, e)
         logger.warning('%sbuild failed in %0.3fs', log_prefix, time() - start_time)
@@ -179,6 +214,38 @@ def update_site(args: UpdateArgs):  # noqa: C901 (ignore complexity)
         return 0
 
 
+def _copy_assets(config: Config, args: UpdateArgs):
+    """
+    Copy new or changed assets and update the path index with their outputs.
+    """
+    global ASSET_MANIFEST, PATH_INDEX
+    config_key = get_config_key(config)
+    if ASSET_MANIFEST is None:
+        ASSET_MANIFEST = AssetManifest(None, config_key)
+    ASSET_MANIFEST.set_config_key(config_key)
+    outputs = {}
+    if args.assets or PATH_INDEX is None:
+        copy_assets(config, outputs, ASSET_MANIFEST)
+        PATH_INDEX = PathIndex(config)
+        PATH_INDEX.scan()
+    else:
+        assets = ASSET_MANIFEST.assets
+        last_outputs = {assets[p][2] for p in args.changed_assets if p in assets}
+        copy_assets(config, outputs, ASSET_MANIFEST, args.changed_assets)
+        PATH_INDEX.remove(last_outputs - outputs.keys())
+    PATH_INDEX.register(outputs)
+
+
+def _load_data(config: Config):
+    """
+    Load all data, files which haven't changed since they were last loaded aren't parsed again.
+    """
+    global DATA_CACHE
+    if DATA_CACHE is None:
+        DATA_CACHE = DataCache(None)
+    return load_data(config, DATA_CACHE)
+
+
 def is_within(location: Path, directory: Path):
     try:
         location.relative_to(directory)
@@ -226,13 +293,13 @@ async def adev(config: Config, port: int, verbose: bool = False):
                     if is_within(path, config.pages_dir):
                         args.pages.add((change, path))
                     elif is_within(path, config.theme_dir / 'assets'):
-                        args.assets = True
+                        args.changed_assets.add(path)
                     elif is_within(path, config.theme_dir / 'sass'):
                         args.sass = True
                     elif is_within(path, config.theme_dir / 'templates'):
                         args.templates = True
                     elif is_within(path, config.data_dir):
-                        args.data = True
+                        args.changed_data.add(path)
                     elif path == config.extensions.path:
                         args.extensions = True
                     elif path == config.config_path:
@@ -1,5 +1,6 @@
 import logging
 import re
+from typing import Optional
 
 from ruamel.yaml import YAMLError
 
@@ -9,6 +10,38 @@ logger = logging.getLogger('harrier.frontmatter')
 FRONT_MATTER_START_REGEX = re.compile(r'---[ \t]*(.*?)\n---[ \t]*\n', re.S)
 FRONT_MATTER_DIVIDER_REGEX = re.compile(r'\n?^--- ?([.\w_-]+) ?---[ \t]*\n', re.S | re.M)
 FRONT_MATTER_DIVIDER_EXTRA_REGEX = re.compile(r'(.*?)\n---[ \t]*\n', re.S | re.M)
+# a line of simple YAML: a key and either an integer or a string which YAML would load as a string without needing
+# quotes or escapes, anything else is left to ruamel
+SIMPLE_YAML_LINE_REGEX = re.compile(
+    r"([a-zA-Z_][\w-]*): +(?:(0|-?[1-9][0-9]*)|([a-zA-Z](?:[\w .,/()'!?&+-]*[\w.,/()'!?&+-])?)) *$", re.A
+)
+# plain scalars which YAML 1.2 doesn't load as strings
+YAML_KEYWORDS = {'true', 'True', 'TRUE', 'false', 'False', 'FALSE', 'null', 'Null', 'NULL'}
+
+
+def load_yaml(s: str):
+    data = load_simple_yaml(s)
+    return yaml.load(s) if data is None else data
+
+
+def load_simple_yaml(s: str) -> Optional[dict]:
+    """
+    Parse YAML made up of "key: value" lines with string or integer values, as most front matter is, without
+    the cost of ruamel. Returns None if the YAML isn't that simple, it should then be parsed with ruamel.
+    """
+    data = {}
+    for line in s.split('\n'):
+        if not line.strip(' '):
+            continue
+        m = SIMPLE_YAML_LINE_REGEX.match(line)
+        if not m:
+            return None
+        key, int_value, str_value = m.groups()
+        # duplicate keys are left to ruamel so the error is the same
+        if key in data or key in YAML_KEYWORDS or str_value in YAML_KEYWORDS:
+            return None
+        data[key] = str_value if int_value is None else int(int_value)
+    return data
 
 
 def parse_yaml(s):
@@ -16,7 +49,7 @@ def parse_yaml(s):
     parse a yaml file like it's a front matter file
     """
     try:
-        data = yaml.load(s) or {}
+        data = load_yaml(s) or {}
     except YAMLError as e:
         logger.error('error parsing YAML: %s', e)
         raise HarrierProblem(f'error parsing YAML: {e}') from e
@@ -28,7 +61,7 @@ def parse_front_matter(s, regex=FRONT_MATTER_START_REGEX):
     if not m:
         return None, s
     try:
-        data = yaml.load(m.group(1)) or {}
+        data = load_yaml(m.group(1)) or {}
     except YAMLError as e:
         logger.error('error parsing YAML: %s', e)
         raise HarrierProblem(f'error parsing YAML: {e}') from e
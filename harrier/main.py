@@ -8,14 +8,16 @@ from typing import Optional, Set, Union
 
 import devtools
 
-from .assets import assets_grablib, get_path_lookup, run_webpack
+from .assets import PathIndex, assets_grablib, run_webpack
 from .build import build_pages, content_templates
+from .cache import BuildManifest, DataCache
 from .common import completed_logger
-from .config import Mode, get_config
+from .config import Config, Mode, get_config
 from .data import load_data
 from .dev import adev
 from .extensions import apply_modifiers, apply_page_generator
-from .render import render_pages
+from .output import prune_dir, snapshot_dir, stale_files
+from .render import get_outfile, render_pages
 
 logger = logging.getLogger('harrier.main')
 StrPath = Union[str, Path]
@@ -34,19 +36,31 @@ class BuildSteps(str, Enum):
 ALL_STEPS = [m.value for m in BuildSteps.__members__.values()]
 
 
-def build(path: StrPath, steps: Set[BuildSteps] = None, mode: Optional[Mode] = None):
+def build(path: StrPath, steps: Set[BuildSteps] = None, mode: Optional[Mode] = None, jobs: Optional[int] = None):
     completed_logger.info('building site...')
     config = get_config(path)
     if mode:
         config.mode = mode
+    if jobs:
+        config.jobs = jobs
     logger.debug('Config: %s', devtools.pformat(config.dict()))
 
     steps = steps or ALL_STEPS
     if BuildSteps.extensions in steps:
         config = apply_modifiers(config, config.extensions.config_modifiers)
 
+    manifest = None
+    if config.build_cache and BuildSteps.pages in steps:
+        manifest = BuildManifest.load(config)
+
     clean = BuildSteps.clean in steps
-    _empty_dir(config.dist_dir, clean)
+    dist_before = None
+    # with sync_dist only changed files are written and with the build cache unchanged pages don't need to be
+    # rendered or written again, so dist_dir is kept and files which aren't output again are removed at the end
+    keep_dist = bool(manifest) or config.sync_dist
+    if clean and keep_dist:
+        dist_before = config.dist_dir.exists() and snapshot_dir(config.dist_dir)
+    _empty_dir(config.dist_dir, clean and not keep_dist)
     _empty_dir(config.get_tmp_dir(), clean)
 
     pages = None
@@ -58,12 +72,13 @@ def build(path: StrPath, steps: Set[BuildSteps] = None, mode: Optional[Mode] = N
         ]
 
         if BuildSteps.data in steps:
-            data_future = executor.submit(load_data, config)
+            data_future = executor.submit(_load_data, config)
 
         if BuildSteps.pages in steps:
-            pages = build_pages(config)
+            pages = build_pages(config, manifest)
         # this will raise errors if any of the above went wrong
-        [f.result() for f in futures if f]
+        grablib_result, _ = [f and f.result() for f in futures]
+    asset_outputs, index = grablib_result or (None, None)
 
     som = dict(
         pages=pages,
@@ -74,17 +89,34 @@ def build(path: StrPath, steps: Set[BuildSteps] = None, mode: Optional[Mode] = N
     if BuildSteps.extensions in steps:
         apply_page_generator(som, config)
 
-    som['path_lookup'] = get_path_lookup(config, pages)
+    index = _path_index(config, index, asset_outputs, BuildSteps.webpack in steps)
+    if dist_before:
+        # stale files are removed at the end, they're ignored now so an old version of a file can't be used
+        index.remove(stale_files(dist_before, _dist_outputs(config, asset_outputs, som['pages'])))
+    index.prune()
+    som['path_lookup'] = index.lookup(pages)
 
     if BuildSteps.extensions in steps:
         som = apply_modifiers(som, config.extensions.som_modifiers)
 
     if som['pages'] is not None:
         content_templates(som['pages'].values(), config)
-        render_pages(config, som)
+        render_pages(config, som, manifest=manifest)
+        manifest and manifest.save()
+
+    dist_before and _prune_dist(config, dist_before, asset_outputs, som['pages'])
     return som
 
 
+def _load_data(config: Config):
+    if not config.build_cache:
+        return load_data(config)
+    cache = DataCache.load(config)
+    data = load_data(config, cache)
+    cache.save()
+    return data
+
+
 def dev(path: StrPath, port: int, verbose: bool = False):
     config = get_config(path)
     config.mode = Mode.development
@@ -97,6 +129,44 @@ def dev(path: StrPath, port: int, verbose: bool = False):
     return loop.run_until_complete(adev(config, port, verbose))
 
 
+def _path_index(config: Config, index: Optional[PathIndex], asset_outputs: Optional[dict], webpack: bool):
+    """
+    Get the index of dist_dir used to build path_lookup. If grablib built an index it's reused, only directories
+    written by sass and webpack are scanned again as they were written after or while it was built.
+    """
+    if index is None:
+        index = PathIndex(config)
+        index.scan()
+        index.register(asset_outputs or {})
+        return index
+
+    index.config = config
+    dist_dir = config.dist_dir
+    scan_dirs = {dist_dir / config.dist_dir_sass}
+    wp = config.webpack
+    if webpack and wp.run:
+        # with a custom webpack config we don't know where files are written
+        scan_dirs.add(dist_dir if wp.config else wp.output_path)
+    if dist_dir in scan_dirs:
+        index.scan()
+    else:
+        for d in scan_dirs:
+            if dist_dir in d.parents:
+                index.scan(d)
+    return index
+
+
+def _dist_outputs(config: Config, asset_outputs: Optional[dict], pages: Optional[dict]) -> set:
+    outputs = set(asset_outputs or ())
+    if pages:
+        outputs.update(get_outfile(p, config) for p in pages.values() if p.get('output', True))
+    return outputs
+
+
+def _prune_dist(config: Config, dist_before: dict, asset_outputs: Optional[dict], pages: Optional[dict]):
+    prune_dir(config.dist_dir, dist_before, _dist_outputs(config, asset_outputs, pages))
+
+
 def _empty_dir(d: Path, clean: bool = True):
     if clean and d.exists():
         shutil.rmtree(d)
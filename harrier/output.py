@@ -0,0 +1,239 @@
+import hashlib
+import logging
+import os
+import shutil
+import stat
+from pathlib import Path
+from queue import Queue
+from threading import Thread
+
+from .config import Config, LinkMode
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger('harrier.output')
+# maximum number of files waiting to be written, once reached rendering waits for the writer to catch up
+WRITE_QUEUE_SIZE = 64
+# files are hashed in chunks of this size so memory use doesn't depend on the size of the file
+HASH_CHUNK_SIZE = 2**20
+# linux ioctl which clones a file's data without copying it, supported by btrfs, xfs and others
+FICLONE = 0x40049409
+
+
+class OutputWriter:
+    """
+    Writes rendered pages and copies files in background threads as soon as they're produced. The queue is bounded
+    so memory use stays flat regardless of the size of the site and disk I/O overlaps with rendering, multiple
+    threads make use of the I/O parallelism available on most filesystems.
+    """
+
+    __slots__ = 'sync', 'link_mode', 'threads', 'queue', 'workers', 'error', 'gen', 'copy'
+
+    def __init__(
+        self,
+        sync: bool = False,
+        link_mode: LinkMode = LinkMode.copy,
+        threads: int = 1,
+        max_queued: int = WRITE_QUEUE_SIZE,
+    ):
+        # when sync is true files whose content hasn't changed aren't written so they keep their mtime
+        self.sync = sync
+        self.link_mode = link_mode
+        self.threads = threads
+        self.queue = Queue(maxsize=max_queued)
+        self.workers = []
+        self.error = None
+        self.gen = 0
+        self.copy = 0
+
+    @classmethod
+    def from_config(cls, config: Config) -> 'OutputWriter':
+        return cls(config.sync_dist, config.link_mode, config.copy_threads)
+
+    def write(self, outfile: Path, content: bytes):
+        self._put(outfile, content)
+        self.gen += 1
+
+    def copy_file(self, infile: Path, outfile: Path):
+        self._put(outfile, infile)
+        self.copy += 1
+
+    def close(self):
+        """
+        Wait for all queued files to be written, returns the number of files generated and copied.
+        """
+        for _ in self.workers:
+            self.queue.put(None)
+        for thread in self.workers:
+            thread.join()
+        self.workers = []
+        if self.error is not None:
+            raise self.error
+        return self.gen, self.copy
+
+    def _put(self, outfile: Path, src):
+        if self.error is not None:
+            raise self.error
+        if not self.workers:
+            for i in range(self.threads):
+                thread = Thread(target=self._run, name=f'harrier-output-{i}', daemon=True)
+                thread.start()
+                self.workers.append(thread)
+        self.queue.put((outfile, src))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                # keep draining the queue so the renderer doesn't block, the error is raised by the next put or close
+                continue
+            outfile, src = item
+            try:
+                if isinstance(src, bytes):
+                    write_bytes(outfile, src, self.sync)
+                else:
+                    copy_file(src, outfile, self.sync, self.link_mode)
+            except Exception as e:
+                logger.error('error writing "%s": %s', outfile, e)
+                self.error = e
+
+
+def write_bytes(path: Path, content: bytes, sync: bool = False) -> bool:
+    """
+    Write content to path, with sync only if the file's content differs. Returns whether the file was written.
+    """
+    if sync and _same_content(path, len(content), lambda: hashlib.md5(content).digest()):
+        return False
+    _remove_link(path)
+    path.write_bytes(content)
+    return True
+
+
+def copy_file(src: Path, dst: Path, sync: bool = False, link_mode: LinkMode = LinkMode.copy) -> bool:
+    """
+    Copy or link src to dst, with sync only if dst isn't already the same. Returns whether the file was copied.
+    """
+    if sync and _up_to_date(src, dst, link_mode):
+        return False
+
+    if link_mode != LinkMode.copy:
+        if dst.is_symlink() or dst.exists():
+            dst.unlink()
+        try:
+            LINKERS[link_mode](src, dst)
+        except OSError as e:
+            logger.debug('unable to %s "%s", copying instead: %s', link_mode.value, dst, e)
+        else:
+            return True
+
+    _remove_link(dst)
+    shutil.copy(src, dst)
+    return True
+
+
+def _hardlink(src: Path, dst: Path):
+    os.link(src, dst)
+
+
+def _symlink(src: Path, dst: Path):
+    os.symlink(src.resolve(), dst)
+
+
+def _reflink(src: Path, dst: Path):
+    if fcntl is None:  # pragma: no cover
+        raise OSError('reflinks are not supported on this platform')
+    with src.open('rb') as fsrc, dst.open('wb') as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+LINKERS = {LinkMode.hardlink: _hardlink, LinkMode.symlink: _symlink, LinkMode.reflink: _reflink}
+
+
+def _remove_link(path: Path):
+    """
+    Remove path if it's a symlink or hardlink so writing to it doesn't modify the source file.
+    """
+    try:
+        s = path.lstat()
+    except FileNotFoundError:
+        return
+    if stat.S_ISLNK(s.st_mode) or s.st_nlink > 1:
+        path.unlink()
+
+
+def _up_to_date(src: Path, dst: Path, link_mode: LinkMode) -> bool:
+    try:
+        s = dst.lstat()
+    except FileNotFoundError:
+        return False
+    if stat.S_ISLNK(s.st_mode):
+        return link_mode == LinkMode.symlink and os.readlink(dst) == str(src.resolve())
+    elif s.st_nlink > 1:
+        return link_mode == LinkMode.hardlink and os.path.samestat(s, src.stat())
+    else:
+        # a copy, including the fallback when linking isn't possible
+        return _same_content(dst, src.stat().st_size, lambda: hash_file(src))
+
+
+def _same_content(path: Path, size: int, get_hash) -> bool:
+    try:
+        if path.stat().st_size != size:
+            return False
+    except FileNotFoundError:
+        return False
+    return hash_file(path) == get_hash()
+
+
+def hash_file(path: Path) -> bytes:
+    """
+    md5 digest of a file's content, read in chunks.
+    """
+    h = hashlib.md5()
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.digest()
+
+
+def snapshot_dir(d: Path) -> dict:
+    """
+    Find files in a directory and the key used to tell if they're modified. Symlinks are included, even if their
+    target no longer exists, and are compared by the link itself.
+    """
+    return {p: _link_key(p) for p in d.glob('**/*') if p.is_symlink() or p.is_file()}
+
+
+def _link_key(p: Path):
+    s = p.lstat()
+    return s.st_mtime_ns, s.st_size
+
+
+def stale_files(before: dict, keep: set):
+    """
+    Find files which existed before the build, haven't been modified since and aren't an output of the build.
+    """
+    for p, key in before.items():
+        if p not in keep and os.path.lexists(p) and _link_key(p) == key:
+            yield p
+
+
+def prune_dir(d: Path, before: dict, keep: set):
+    """
+    Remove stale files, then remove directories left empty.
+    """
+    removed = 0
+    for p in stale_files(before, keep):
+        logger.debug('removing stale output "%s"', p)
+        p.unlink()
+        removed += 1
+
+    for p in sorted(d.glob('**/*'), key=lambda p: len(p.parts), reverse=True):
+        if p.is_dir() and not any(p.iterdir()):
+            p.rmdir()
+    logger.debug('removed %d stale files from "%s"', removed, d)
+    return removed
@@ -2,17 +2,31 @@ import datetime as datetime
 import hashlib
 import json
 import logging
+import os
 import re
-import shutil
 from collections import namedtuple
+from collections.abc import Sequence
+from contextlib import suppress
+from functools import lru_cache
 from html import escape
 from pathlib import Path
 from textwrap import dedent
 from time import time
 from types import GeneratorType
+from typing import Optional
 
+import pygments
 from devtools import debug, pformat
-from jinja2 import Environment, FileSystemLoader, nodes, pass_context
+from jinja2 import (
+    BaseLoader,
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    TemplateNotFound,
+    nodes,
+    pass_context,
+)
 from jinja2.ext import Extension
 from misaka import HtmlRenderer, Markdown, escape_html
 from PIL import Image
@@ -23,74 +37,246 @@ from pygments.lexers import get_lexer_by_name
 
 from .assets import resolve_path
 from .build import OUTPUT_HTML
-from .common import HarrierProblem, PathMatch, log_complete, slugify
-from .config import Config
+from .cache import BuildManifest, LRUCache, file_key, hash_obj
+from .common import ALL, HarrierProblem, TrackedDict, log_complete, parallel_map, path_match_set, slugify
+from .config import Config, Mode
+from .data import CsvRow, CsvTable, load_value
 from .frontmatter import split_content
+from .output import OutputWriter
+from .version import VERSION
 
 logger = logging.getLogger('harrier.render')
 
 
-def render_pages(config: Config, som: dict, build_cache=None):
+def render_pages(
+    config: Config, som: dict, build_cache=None, manifest: BuildManifest = None, env: 'TrackingEnvironment' = None
+):
     start = time()
-    cache, files = Renderer(config, som, build_cache).run()
+    cache, files = Renderer(config, som, build_cache, manifest, env).run()
     log_complete(start, 'pages rendered', files)
     return cache
 
 
 class Renderer:
-    __slots__ = 'config', 'som', 'build_cache', 'md', 'env', 'checked_dirs', 'ctx', 'to_gen', 'to_copy'
-
-    def __init__(self, config: Config, som: dict, build_cache: dict = None):
+    __slots__ = (
+        'config',
+        'som',
+        'build_cache',
+        'manifest',
+        'deps',
+        'dep_hashes',
+        'tracked_som',
+        'md',
+        'env',
+        'checked_dirs',
+        'writer',
+    )
+
+    def __init__(
+        self,
+        config: Config,
+        som: dict,
+        build_cache: dict = None,
+        manifest: BuildManifest = None,
+        env: 'TrackingEnvironment' = None,
+    ):
         self.config = config
         self.som = som
-        self.build_cache = build_cache
-
-        md_renderer = HarrierHtmlRenderer()
-        self.md = Markdown(md_renderer, extensions=MD_EXTENSIONS)
-
-        template_dirs = [str(self.config.get_tmp_dir()), str(self.config.theme_dir / 'templates')]
-        logger.debug('template directories: %s', ', '.join(template_dirs))
-
-        extensions = 'jinja2.ext.loopcontrols', MarkdownExtension
-        self.env = Environment(loader=FileSystemLoader(template_dirs), extensions=extensions)
-        self.env.filters.update(
-            glob=page_glob,
-            slugify=slugify,
-            format=format_filter,
-            tojson=json_filter,
-            debug=debug_filter,
-            markdown=self.md,
-            paginate=paginate_filter,
-        )
-        self.env.filters.update(self.config.extensions.template_filters)
-
-        self.env.globals.update(
-            url=resolve_url,
-            resolve_url=resolve_url,
-            inline_css=inline_css,
-            shape=shape,
-            width=width,
-            height=height,
-        )
-        self.env.globals.update(self.config.extensions.template_functions)
-        self.env.tests.update(self.config.extensions.template_tests)
+        self.manifest = manifest
+        if manifest is None:
+            self.build_cache = build_cache
+            self.deps = {}
+        else:
+            self.build_cache = manifest.outputs
+            self.deps = manifest.deps
+        self.dep_hashes = {}
+        # the som passed to templates, accessing pages and data is recorded as dependencies of the page
+        self.tracked_som = {**som, 'pages': TrackedDict('pages', som['pages'])}
+        data = som.get('data')
+        if isinstance(data, TrackedDict):
+            # eg. LazyData which records the keys accessed itself, copying it would load every file
+            self.tracked_som['data'] = data
+        elif isinstance(data, dict):
+            self.tracked_som['data'] = TrackedDict('data', data)
+
+        self.env = env or create_environment(config)
+        self.md = self.env.md
+        # page content is rendered from memory rather than being written to tmp_dir and loaded from there
+        self.env.content_loader.content = {
+            str(p['content_template']): p['content'] for p in som['pages'].values() if 'content_template' in p
+        }
         self.checked_dirs = set()
-        self.to_gen = []
-        self.to_copy = []
+        self.writer = OutputWriter.from_config(config)
 
     def run(self):
-        for p in self.som['pages'].values():
-            self.render_file(p)
+        if self.manifest is None:
+            keys = list(self.som['pages'])
+        else:
+            keys, page_keys, outfiles = self._check_manifest()
 
-        for outfile, content in self.to_gen:
-            outfile.write_bytes(content)
-        for infile, outfile in self.to_copy:
-            shutil.copy(infile, outfile)
-        gen, copy = len(self.to_gen), len(self.to_copy)
+        if self.config.jobs > 1 and len(keys) > 1:
+            gen, copy = self._run_parallel(keys)
+        else:
+            gen, copy = self.render_keys(keys)
 
+        if self.manifest is not None:
+            logger.debug('%d pages unchanged since the last build', len(page_keys) - len(keys))
+            self._update_manifest(page_keys, outfiles)
+        if self.config.build_cache:
+            self.md.save(self.config.get_cache_dir())
         logger.debug('generated %d files, copied %d files', gen, copy)
         return self.build_cache, gen + copy
 
+    def _check_manifest(self):
+        """
+        Find the pages which need rendering because their inputs have changed since the last build and
+        remove the outputs of pages which no longer exist.
+        """
+        site_key = self._site_key()
+        page_keys, outfiles, to_render = {}, {}, []
+        for k, page in self.som['pages'].items():
+            if not page.get('output', True):
+                continue
+            outfile = outfiles[k] = get_outfile(page, self.config)
+            page_key = page_keys[k] = site_key + self._dep_hash(('pages', k))
+            if not outfile.exists():
+                # the output must be written even if it's the same as the last build
+                self.build_cache.pop(page['infile'], None)
+                to_render.append(k)
+            elif self.manifest.render_keys.get(k) != self._render_key(page_key, page):
+                to_render.append(k)
+
+        for outfile in self._last_outfiles() - set(outfiles.values()):
+            # lexists so symlinks whose source has been deleted are also removed
+            if os.path.lexists(outfile):
+                logger.debug('removing stale output "%s"', outfile)
+                outfile.unlink()
+        return to_render, page_keys, outfiles
+
+    def _last_outfiles(self) -> set:
+        """
+        Outputs of the last build, any outside dist_dir are ignored so they're never removed.
+        """
+        dist_dir = self.config.dist_dir
+        return {f for f in self.manifest.outfiles.values() if dist_dir in f.parents}
+
+    def _update_manifest(self, page_keys, outfiles):
+        pages = self.som['pages']
+        infiles = {pages[k]['infile'] for k in page_keys}
+        self.manifest.deps = self.deps = {k: v for k, v in self.deps.items() if k in infiles}
+        # dependencies might have changed while rendering, so render keys are calculated again
+        self.manifest.render_keys = {k: self._render_key(v, pages[k]) for k, v in page_keys.items()}
+        self.manifest.outfiles = outfiles
+
+    def _render_key(self, page_key: bytes, page: dict) -> bytes:
+        """
+        Combine the page key with the hashes of the templates, pages, data and files the page used when it was last
+        rendered.
+        """
+        h = hashlib.md5(page_key)
+        for dep in sorted(self.deps.get(page['infile'], ()), key=repr):
+            h.update(self._dep_hash(dep))
+        return h.digest()
+
+    def _dep_hash(self, dep) -> bytes:
+        v = self.dep_hashes.get(dep)
+        if v is not None:
+            return v
+
+        kind, key = dep
+        if kind == 'template':
+            try:
+                v, _, _ = self.env.loader.get_source(self.env, key)
+            except TemplateNotFound:
+                v = None
+        elif kind == 'file':
+            # files in dist_dir read by inline_css, shape, width and height
+            try:
+                v = file_key(Path(key))
+            except FileNotFoundError:
+                v = None
+        elif kind == 'data':
+            v = self._data_dep(key)
+        elif key == ALL:
+            v = b''.join(k.encode() + self._dep_hash(('pages', k)) for k in self.som['pages'])
+        elif isinstance(key, tuple):
+            # pages matched by the glob filter
+            _, test, globs = key
+            items = _glob_items(self.som['pages'].items(), globs, test)
+            v = b''.join(k.encode() + self._dep_hash(('pages', k)) for k, _ in items)
+        else:
+            v = self.som['pages'].get(key)
+        v = self.dep_hashes[dep] = hash_obj(v)
+        return v
+
+    def _data_dep(self, key):
+        data = self.som.get('data') or {}
+        # dict methods so LazyData isn't loaded, the repr of its unloaded files includes their file key
+        if key == ALL:
+            return data
+        elif isinstance(key, tuple):
+            # data matched by the glob filter
+            _, test, globs = key
+            return list(_glob_items(dict.items(data), globs, test))
+        else:
+            return dict.get(data, key)
+
+    def _site_key(self):
+        """
+        Hash of everything other than the page itself, its templates, pages, data and files which could be used when
+        rendering a page, any change here means every page is rendered.
+        """
+        h = hashlib.md5(self.manifest.config_key)
+
+        # page entries are excluded as their last_mod changes with every build as are the outputs of the last build
+        # which are still in dist_dir, mtimes are only used in development
+        dev = self.config.mode == Mode.development
+        last_outputs = {str(f.relative_to(self.config.dist_dir)) for f in self._last_outfiles()}
+        path_lookup = {k: v for k, v in (self.som.get('path_lookup') or {}).items() if k not in last_outputs}
+        h.update(hash_obj({k: v if dev else v[0] for k, v in path_lookup.items() if not v[1]}))
+
+        h.update(hash_obj({k: v for k, v in self.som.items() if k not in {'pages', 'data', 'config', 'path_lookup'}}))
+        return h.digest()
+
+    def render_keys(self, keys):
+        """
+        Render the given pages and wait for them to be written, returns the number of files generated and copied.
+        """
+        pages = self.som['pages']
+        try:
+            for k in keys:
+                self.render_file(pages[k])
+        except Exception:
+            # stop the writer thread, the rendering error is more useful than any error writing files
+            with suppress(Exception):
+                self.flush()
+            raise
+        return self.flush()
+
+    def flush(self):
+        """
+        Wait for rendered pages and copied files to be written, returns the number of files generated and copied.
+        """
+        writer, self.writer = self.writer, OutputWriter.from_config(self.config)
+        return writer.close()
+
+    def _run_parallel(self, keys):
+        """
+        Render pages in chunks across a pool of processes, each worker has its own Renderer and therefore its
+        own jinja environment and markdown instance, rendered files are written directly by the workers.
+        """
+        gen = copy = 0
+        initargs = self.config, self.som, self.build_cache
+        results = parallel_map(_render_chunk, keys, self.config.jobs, _init_render_worker, initargs, config=self.config)
+        for chunk_gen, chunk_copy, cache_update, deps, md_update in results:
+            gen += chunk_gen
+            copy += chunk_copy
+            if self.build_cache is not None:
+                self.build_cache.update(cache_update)
+            self.deps.update(deps)
+            md_update and self.md.update(md_update)
+        return gen, copy
+
     def render_file(self, data):
         if not data.get('output', True):
             return
@@ -112,9 +298,11 @@ class Renderer:
 
     def render_template(self, data: dict, infile: Path, outfile: Path):
         template_file = data['template']
+        deps = set()
+        self._track(deps)
         try:
             content_template = self.env.get_template(str(data['content_template']))
-            content = content_template.render(page=data, **self.som)
+            content = content_template.render(page=data, **self.tracked_som)
 
             content = split_content(content)
 
@@ -129,25 +317,39 @@ class Renderer:
 
             if template_file:
                 template = self.env.get_template(template_file)
-                rendered = template.render(content=content, page=data, **self.som)
+                rendered = template.render(content=content, page=data, **self.tracked_som)
             else:
                 rendered = content
             rendered = rendered.rstrip(' \t\r\n') + '\n'
         except Exception as e:
             logger.exception('%s: error rendering page', infile)
             raise HarrierProblem(f'{e.__class__.__name__}: {e}') from e
-        else:
-            for post_page_render in self.config.extensions.post_page_render:
-                rendered = post_page_render(page=data, html=rendered)
-            rendered_b = rendered.encode()
-            if self.build_cache is not None:
-                out_hash = hashlib.md5(rendered_b).digest()
-                if self.build_cache.get(infile) == out_hash:
-                    # file hasn't changed
-                    return
-                else:
-                    self.build_cache[infile] = out_hash
-            self.to_gen.append((outfile, rendered_b))
+        finally:
+            self._track(None)
+
+        deps.discard(('template', str(data['content_template'])))
+        self.deps[infile] = frozenset(deps)
+        for post_page_render in self.config.extensions.post_page_render:
+            rendered = post_page_render(page=data, html=rendered)
+        rendered_b = rendered.encode()
+        if self.build_cache is not None:
+            out_hash = hashlib.md5(rendered_b).digest()
+            if self.build_cache.get(infile) == out_hash:
+                # file hasn't changed
+                return
+            else:
+                self.build_cache[infile] = out_hash
+        self.writer.write(outfile, rendered_b)
+
+    def _track(self, deps: Optional[set]):
+        """
+        Set where templates, pages and data accessed while rendering are recorded, None to stop recording.
+        """
+        self.env.accessed = deps
+        for k in 'pages', 'data':
+            v = self.tracked_som.get(k)
+            if isinstance(v, TrackedDict):
+                v._accessed = deps
 
     def _md_content(self, v):
         v['content'] = self.md(v['content'])
@@ -161,25 +363,159 @@ class Renderer:
                 return
             else:
                 self.build_cache[infile] = mtime
-        self.to_copy.append((infile, outfile))
+        self.writer.copy_file(infile, outfile)
+
+
+def create_environment(config: Config) -> 'TrackingEnvironment':
+    """
+    Create the jinja environment used to render pages. Compiled templates are cached in the cache directory
+    so they're only compiled again when their source changes, "harrier dev" also reuses the environment between
+    builds.
+    """
+    md = CachedMarkdown()
+    if config.build_cache:
+        md.load(config.get_cache_dir())
+
+    template_dir = str(config.theme_dir / 'templates')
+    logger.debug('template directory: %s', template_dir)
+
+    bytecode_dir = config.get_cache_dir() / 'jinja'
+    bytecode_dir.mkdir(parents=True, exist_ok=True)
+    content_loader = ContentLoader()
+    env = TrackingEnvironment(
+        loader=ChoiceLoader([content_loader, FileSystemLoader(template_dir)]),
+        extensions=('jinja2.ext.loopcontrols', MarkdownExtension),
+        bytecode_cache=FileSystemBytecodeCache(str(bytecode_dir)),
+    )
+    env.md = md
+    env.content_loader = content_loader
+    env.filters.update(
+        glob=page_glob,
+        slugify=slugify,
+        format=format_filter,
+        tojson=json_filter,
+        debug=debug_filter,
+        markdown=md,
+        paginate=paginate_filter,
+    )
+    env.filters.update(config.extensions.template_filters)
+
+    env.globals.update(
+        url=resolve_url,
+        resolve_url=resolve_url,
+        inline_css=inline_css,
+        shape=shape,
+        width=width,
+        height=height,
+    )
+    env.globals.update(config.extensions.template_functions)
+    env.tests.update(config.extensions.template_tests)
+    return env
+
+
+# set in each worker process by _init_render_worker when rendering in parallel
+WORKER_RENDERER: Renderer = None
+
+
+def _init_render_worker(config: Config, som: dict, build_cache: dict = None):
+    global WORKER_RENDERER
+    WORKER_RENDERER = Renderer(config, som, build_cache)
+    if config.build_cache:
+        # markdown rendered by workers is sent back to the main process so it can be saved
+        WORKER_RENDERER.md.track_new()
+
+
+def _render_chunk(keys):
+    renderer = WORKER_RENDERER
+    gen, copy = renderer.render_keys(keys)
+    infiles = [renderer.som['pages'][k]['infile'] for k in keys]
+    cache_update = {}
+    if renderer.build_cache is not None:
+        cache_update = {f: renderer.build_cache[f] for f in infiles if f in renderer.build_cache}
+    deps = {f: renderer.deps[f] for f in infiles if f in renderer.deps}
+    md_update = renderer.md.pop_new()
+    return gen, copy, cache_update, deps, md_update
+
+
+class TrackingEnvironment(Environment):
+    """
+    Environment which records the templates loaded while rendering a page, including those loaded via extends,
+    include and import. Loading is tracked here rather than in the loader since the loader isn't called when
+    a template is already in the environment's cache.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.accessed = None
+        self.md = None
+        self.content_loader = None
+
+    def _load_template(self, name, globals):
+        if self.accessed is not None:
+            self.accessed.add(('template', name))
+        return super()._load_template(name, globals)
+
+
+class ContentLoader(BaseLoader):
+    """
+    Loads the content templates of pages from memory. The template name is also used as the filename in
+    tracebacks since line numbers are relative to the page's content, not the whole file.
+
+    Content templates are compiled without the bytecode cache, caching them would write a file per page.
+    """
+
+    def __init__(self):
+        self.content = {}
+
+    def get_source(self, environment, template):
+        source = self.content.get(template)
+        if source is None:
+            raise TemplateNotFound(template)
+        return source, template, lambda: self.content.get(template) == source
+
+    def load(self, environment, name, globals=None):
+        source, filename, uptodate = self.get_source(environment, name)
+        code = environment.compile(source, name, filename)
+        return environment.template_class.from_code(environment, code, environment.make_globals(globals), uptodate)
 
 
 DL_REGEX = re.compile('<li>(.*?)::(.*?)</li>', re.S)
 LI_REGEX = re.compile('<li>(.*?)</li>', re.S)
 MD_EXTENSIONS = 'fenced-code', 'strikethrough', 'no-intra-emphasis', 'tables'
+MARKDOWN_CACHE_SIZE = 10_000
+MARKDOWN_CACHE_FILE = 'markdown.pickle'
+HIGHLIGHT_CACHE_SIZE = 10_000
+HIGHLIGHT_CACHE_FILE = 'highlight.pickle'
+# output also depends on the markdown extensions and the versions of harrier and pygments
+MARKDOWN_CACHE_SALT = hash_obj((VERSION, pygments.__version__, MD_EXTENSIONS))
+
+
+@lru_cache(maxsize=None)
+def get_lexer(lang):
+    try:
+        return get_lexer_by_name(lang, stripall=True)
+    except ClassNotFound:
+        return None
+
+
+HIGHLIGHT_FORMATTER = HtmlFormatter(cssclass='hi')
 
 
 class HarrierHtmlRenderer(HtmlRenderer):
-    @staticmethod
-    def blockcode(text, lang):
-        try:
-            lexer = get_lexer_by_name(lang, stripall=True)
-        except ClassNotFound:
-            lexer = None
+    def __init__(self, highlight_cache: LRUCache = None):
+        super().__init__()
+        # highlighted code blocks keyed by a hash of the language and code
+        self.highlight_cache = highlight_cache or LRUCache(HIGHLIGHT_CACHE_SIZE)
 
+    def blockcode(self, text, lang):
+        lexer = lang and get_lexer(lang)
         if lexer:
-            formatter = HtmlFormatter(cssclass='hi')
-            return highlight(text, lexer, formatter)
+            key = hashlib.md5(MARKDOWN_CACHE_SALT + f'{lang}\0{text}'.encode()).digest()
+            html = self.highlight_cache.get(key)
+            if html is None:
+                html = highlight(text, lexer, HIGHLIGHT_FORMATTER)
+                self.highlight_cache.set(key, html)
+            return html
 
         code = escape_html(text.strip())
         return f'<pre><code>{code}</code></pre>\n'
@@ -202,6 +538,55 @@ class HarrierHtmlRenderer(HtmlRenderer):
         return f'<u>{content}</u>'
 
 
+class CachedMarkdown:
+    """
+    Renders markdown to html, results are kept in an LRU cache keyed by a hash of the source so repeated and
+    unchanged markdown costs a lookup rather than parsing and highlighting. Highlighted code blocks are cached
+    separately so they're reused when other content on a page changes.
+    """
+
+    __slots__ = 'md', 'cache', 'highlight_cache'
+
+    def __init__(self):
+        self.cache = LRUCache(MARKDOWN_CACHE_SIZE)
+        self.highlight_cache = LRUCache(HIGHLIGHT_CACHE_SIZE)
+        self.md = Markdown(HarrierHtmlRenderer(self.highlight_cache), extensions=MD_EXTENSIONS)
+
+    def _caches(self):
+        return (MARKDOWN_CACHE_FILE, self.cache), (HIGHLIGHT_CACHE_FILE, self.highlight_cache)
+
+    def load(self, cache_dir: Path):
+        for name, cache in self._caches():
+            cache.load(cache_dir / name)
+
+    def save(self, cache_dir: Path):
+        for name, cache in self._caches():
+            cache.save(cache_dir / name)
+
+    def track_new(self):
+        for _, cache in self._caches():
+            cache.track_new()
+
+    def pop_new(self):
+        """
+        Entries added to each cache since the last call, or None if new entries aren't being tracked.
+        """
+        if self.cache.new is not None:
+            return [cache.pop_new() for _, cache in self._caches()]
+
+    def update(self, new):
+        for (_, cache), items in zip(self._caches(), new):
+            cache.update(items)
+
+    def __call__(self, text: str) -> str:
+        key = hashlib.md5(MARKDOWN_CACHE_SALT + text.encode()).digest()
+        html = self.cache.get(key)
+        if html is None:
+            html = self.md(text)
+            self.cache.set(key, html)
+        return html
+
+
 def get_outfile(data: dict, config: Config):
     outfile = config.dist_dir / data['uri'][1:]
     html_output = data['infile'].suffix in OUTPUT_HTML
@@ -221,6 +606,7 @@ def inline_css(ctx, path):
     real_path = Path(path[1:])
     config: Config = ctx['config']
     p = config.dist_dir / real_path
+    _record_file(ctx, p)
     css = p.read_text()
     map_path = real_path.with_suffix('.css.map')
     if (config.dist_dir / map_path).exists():
@@ -228,13 +614,40 @@ def inline_css(ctx, path):
     return css.strip('\r\n ')
 
 
+def _record_file(ctx, path: Path):
+    """
+    Record a file read while rendering as a dependency of the page, the page is rendered again if the file changes.
+    """
+    accessed = getattr(ctx.environment, 'accessed', None)
+    if accessed is not None:
+        accessed.add(('file', str(path)))
+
+
 def page_glob(pages, *globs, test='path'):
+    if isinstance(pages, CsvTable):
+        # rows of csv data are matched on one of their columns
+        match = path_match_set(globs)
+        yield from (row for row in pages if match(row[test]))
+        return
+
     assert test in ('uri', 'path'), 'the "test" argument should be either "uri" or "path"'
-    matches = globs and [PathMatch(glob) for glob in globs]
-    for k, page in pages.items():
+    if isinstance(pages, TrackedDict):
+        # only the pages matching the globs are dependencies of the page being rendered, not all pages
+        pages._record(('glob', test, globs))
+        items = dict.items(pages)
+    else:
+        items = pages.items()
+    for _, page in _glob_items(items, globs, test):
+        # with LazyData only the files matching the globs are loaded
+        yield load_value(pages, page)
+
+
+def _glob_items(items, globs, test):
+    match = path_match_set(globs)
+    for k, page in items:
         glob_key = k if test == 'path' else page['uri']
-        if any(match(glob_key) for match in matches):
-            yield page
+        if match(glob_key):
+            yield k, page
 
 
 def format_filter(s, *args, **kwargs):
@@ -251,6 +664,7 @@ def shape(ctx, path):
     config: Config = ctx['config']
     path = resolve_path(path, ctx['path_lookup'], None)
     path = config.dist_dir / Path(path[1:])
+    _record_file(ctx, path)
     cache_key = f'{path}:{path.stat().st_mtime}'
     v = IMAGE_SIZE_CACHE.get(cache_key)
     if not v:
@@ -273,6 +687,9 @@ def height(ctx, path):
 def paginate_filter(ctx, v, page=1, per_page=None):
     per_page = per_page or ctx['config'].paginate_by
     start = (page - 1) * per_page
+    if isinstance(v, Sequence):
+        # avoids copying the whole sequence, CsvTable only creates rows for the page
+        return list(v[start : start + per_page])
     return list(v)[start : start + per_page]
 
 
@@ -289,6 +706,8 @@ class UniversalEncoder(json.JSONEncoder):
         frozenset: list,
         GeneratorType: list,
         bytes: lambda o: o.decode(),
+        CsvTable: list,
+        CsvRow: dict,
     }
 
     def default(self, obj):
@@ -57,6 +57,8 @@ setup(
         'pydantic>=2.1.1',
         'Pygments>=2.15',
         'ruamel.yaml>=0.17',
+        # C parser which ruamel.yaml uses for typ='safe' when it's installed
+        'ruamel.yaml.clib>=0.2.7; platform_python_implementation=="CPython"',
         'watchfiles>=0.19.0',
-    ]
+    ],
 )
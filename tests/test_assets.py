@@ -3,14 +3,29 @@ import json
 import logging
 import re
 import sys
+from pathlib import Path
 
 import pytest
 from dirty_equals import IsStr
+from grablib.build import insert_hash
 from pydantic import ValidationError
 
-from harrier.assets import assets_grablib, copy_assets, run_grablib, run_webpack, start_webpack_watch
+import harrier.assets
+from harrier.assets import (
+    PathIndex,
+    assets_grablib,
+    copy_assets,
+    get_path_lookup,
+    insert_content_hash,
+    run_grablib,
+    run_webpack,
+    start_webpack_watch,
+)
+from harrier.cache import AssetManifest
 from harrier.common import HarrierProblem
 from harrier.config import Mode, get_config
+from harrier.main import build
+from harrier.output import hash_file
 from tests.utils import gettree, mktree
 
 MOCK_WEBPACK = f"""\
@@ -311,6 +326,32 @@ def test_resolve_sass_path(tmpdir):
     }
 
 
+def test_assets_grablib_no_sass(tmpdir, mocker):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'theme/assets/image.png': '*', 'dist/old.txt': 'old'})
+    spy_scan = mocker.spy(PathIndex, 'scan')
+    config = get_config(str(tmpdir))
+    assert assets_grablib(config) == ({Path(tmpdir) / 'dist/image.3389dae.png': 'image.png'}, None)
+    assert spy_scan.call_count == 0
+
+
+def test_build_reuses_sass_index(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages/index.html': '{{ url("assets/image.png") }} {{ url("theme/main.css") }}',
+            'theme': {
+                'assets/assets/image.png': '*',
+                'sass/main.scss': 'body {content: resolve_path("/assets/image.png")}',
+            },
+        },
+    )
+    spy_scan = mocker.spy(PathIndex, 'scan')
+    build(tmpdir, mode=Mode.production)
+    assert tmpdir.join('dist/index.html').read_text('utf8') == '/assets/image.3389dae.png /theme/main.d024f29.css\n'
+    # dist_dir is scanned by grablib in another process, the build only scans the sass output again
+    assert [c.args[1:] for c in spy_scan.call_args_list] == [(Path(tmpdir) / 'dist/theme',)]
+
+
 def test_resolve_sass_path_dev(tmpdir):
     mktree(
         tmpdir,
@@ -430,3 +471,117 @@ def test_copy_assets_prod(tmpdir):
         'favicon.ico': '*',
         'move': {'foobar.9dd4e46.svg': 'x'},
     }
+
+
+@pytest.mark.parametrize('name', ['foo.png', 'foo.min.js', 'foo', '.foo'])
+def test_insert_content_hash(tmpdir, mocker, name):
+    mocker.patch('harrier.output.HASH_CHUNK_SIZE', 10)
+    p = Path(tmpdir) / name
+    content = b'x' * 25 + b'y' * 10
+    p.write_bytes(content)
+    assert insert_content_hash(p, hash_file(p)) == insert_hash(p, content)
+
+
+def test_copy_assets_manifest(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages/foobar.md': '# hello',
+            'theme/assets': {'image.png': '*', 'favicon.ico': '*', 'move': {'foobar.svg': 'x'}},
+        },
+    )
+    config = get_config(str(tmpdir))
+    config.mode = Mode.production
+    manifest = AssetManifest(None, b'key')
+    assert copy_assets(config, manifest=manifest) == 3
+    expected_tree = {'image.3389dae.png': '*', 'favicon.ico': '*', 'move': {'foobar.9dd4e46.svg': 'x'}}
+    assert gettree(tmpdir.join('dist')) == expected_tree
+    assert len(manifest.assets) == 3
+
+    spy_hash = mocker.spy(harrier.assets, 'hash_file')
+    assert copy_assets(config, manifest=manifest) == 0
+    assert spy_hash.call_count == 0
+
+    tmpdir.join('theme/assets/image.png').write('+')
+    tmpdir.join('theme/assets/move/foobar.svg').remove()
+    favicon = tmpdir.join('theme/assets/favicon.ico')
+    favicon.setmtime(favicon.mtime() + 10)
+    changed = {Path(tmpdir.join('theme/assets', p)) for p in ('image.png', 'move/foobar.svg', 'favicon.ico')}
+    assert copy_assets(config, manifest=manifest, changed=changed) == 1
+    assert gettree(tmpdir.join('dist')) == {'image.26b1722.png': '+', 'favicon.ico': '*'}
+    assert len(manifest.assets) == 2
+
+    manifest.set_config_key(b'changed')
+    assert copy_assets(config, manifest=manifest) == 2
+    assert gettree(tmpdir.join('dist')) == {'image.26b1722.png': '+', 'favicon.ico': '*'}
+
+
+def test_path_index(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'pages/foobar.md': '# hello',
+            'dist': {'foo.1234567.png': '*', 'theme': {'main.css': 'x', 'spam.css': 'y'}},
+        },
+    )
+    config = get_config(str(tmpdir))
+    index = PathIndex(config)
+    index.scan()
+    assert index.lookup() == get_path_lookup(config)
+    assert index.lookup().keys() == {'foo.png', 'theme/main.css', 'theme/spam.css'}
+
+    tmpdir.join('dist/foo.1234567.png').remove()
+    tmpdir.join('dist/theme/spam.css').remove()
+    tmpdir.join('dist/new.8901234.txt').write('new')
+    tmpdir.join('dist/theme/other.css').write('z')
+    index.remove([Path(tmpdir.join('dist/foo.1234567.png'))])
+    index.add([Path(tmpdir.join('dist/new.8901234.txt'))])
+    index.scan(Path(tmpdir.join('dist/theme')))
+    assert index.lookup() == get_path_lookup(config)
+    assert index.lookup().keys() == {'new.txt', 'theme/main.css', 'theme/other.css'}
+    assert index.lookup()['new.txt'][0] == '/new.8901234.txt'
+
+
+def test_path_index_registered(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'pages/foobar.md': '# hello',
+            'dist': {
+                'logo.1111111.svg': 'old',
+                'logo.2222222.svg': 'new',
+                'main.aaaaaaa.css': 'a',
+                'main.bbbbbbb.css': 'b',
+            },
+        },
+    )
+    config = get_config(str(tmpdir))
+    index = PathIndex(config)
+    index.scan()
+    index.register({Path(tmpdir.join('dist/logo.2222222.svg')): 'logo.svg'})
+    lookup = index.lookup()
+    assert lookup['logo.svg'][0] == '/logo.2222222.svg'
+    # lookup doesn't change dist_dir
+    assert tmpdir.join('dist/logo.1111111.svg').check()
+
+    assert index.prune() == ['logo.1111111.svg']
+    # the old version of a registered file is removed
+    assert not tmpdir.join('dist/logo.1111111.svg').check()
+    # neither is registered, so both are kept
+    assert tmpdir.join('dist/main.aaaaaaa.css').check()
+    assert tmpdir.join('dist/main.bbbbbbb.css').check()
+    assert index.lookup() == lookup
+
+
+def test_copy_assets_hash_collision(tmpdir):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'theme/assets': {'foo.png': '*', 'foo.1234567.png': '+'}})
+    config = get_config(str(tmpdir))
+    config.mode = Mode.development
+    outputs = {}
+    copy_assets(config, outputs)
+    assert sorted(outputs.values()) == ['foo.1234567.png', 'foo.png']
+    index = PathIndex(config)
+    index.scan()
+    index.register(outputs)
+    assert index.lookup()['foo.png'][0] == '/foo.png'
+    assert index.lookup()['foo.1234567.png'][0] == '/foo.1234567.png'
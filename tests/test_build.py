@@ -5,8 +5,11 @@ import pytest
 from dirty_equals import IsNow
 from pydantic import ValidationError
 
-from harrier.build import FileData, build_pages, content_templates
-from harrier.common import HarrierProblem
+import harrier.build
+import harrier.common
+import harrier.render
+from harrier.build import FileData, build_pages, content_templates, fast_file_data, placeholder_plan
+from harrier.common import HarrierProblem, PathMatch, path_match_set, walk_files
 from harrier.config import Config, Mode
 from harrier.main import build
 from harrier.render import render_pages
@@ -52,7 +55,6 @@ def test_simple_render(tmpdir):
         {
             'pages': {'foobar.md': foo_page, 'spam.html': '# SPAM', 'favicon.ico': '*'},
             'theme/templates/main.jinja': 'main, content:\n\n{{ content }}',
-            'tmp/content/foobar.md': foo_page,
         },
     )
     config = Config(
@@ -68,6 +70,7 @@ def test_simple_render(tmpdir):
                 'infile': config.pages_dir / 'foobar.md',
                 'template': 'main.jinja',
                 'content_template': Path('content') / 'foobar.md',
+                'content': foo_page,
             },
             'favicon.ico': {'uri': '/favicon.ico', 'infile': config.pages_dir / 'favicon.ico'},
         }
@@ -136,6 +139,120 @@ def test_build_default_placeholders(tmpdir):
     } == pages
 
 
+def test_walk_files(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'b.txt': '1',
+            'a': {'z.txt': '2', 'b': {'c.txt': '3'}},
+            'A.txt': '4',
+            '.hidden': '5',
+            'c': {'a.txt': '6', 'empty': {}},
+        },
+    )
+    root = Path(tmpdir)
+    expected = sorted(root.glob('**/*'), key=lambda p: (len(p.parents), str(p)))
+    expected = [p for p in expected if p.is_file()]
+    assert [Path(e.path) for e in walk_files(root)] == expected
+    assert [e.name for e in walk_files(root, lambda p: p.endswith('/a'))] == ['.hidden', 'A.txt', 'b.txt', 'a.txt']
+
+
+def test_build_ignore_dir(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages': {
+                'index.md': '# hello',
+                'drafts': {'foo.md': 'foo', 'more': {'bar.md': 'bar'}},
+                'posts': {'bar.md': 'bar', 'bar.txt': 'bar'},
+            }
+        },
+    )
+    mock_scandir = mocker.spy(harrier.common.os, 'scandir')
+    config = Config(source_dir=str(tmpdir), ignore=['/drafts/*', '/posts/*.txt'])
+    pages = build_pages(config)
+    assert set(pages) == {'/index.md', '/posts/bar.md'}
+    assert [Path(c[0][0]).name for c in mock_scandir.call_args_list] == ['pages', 'posts']
+
+
+def test_placeholder_plan():
+    defaults = {
+        'a': 'x',
+        'b': '{{ title }}-{{ a }}',
+        'c': {'d': '{{ slug }}', 'e': 1},
+        'f': ['{{ title }}'],
+        'g': 2,
+    }
+    plan = placeholder_plan(defaults)
+    assert placeholder_plan(defaults) is plan
+    assert list(plan.keys) == ['b', 'c', 'f']
+    assert plan.names == ['title', 'a', 'slug']
+
+    data = {'title': 'Foo', 'slug': 'foo'}
+    plan.apply(data)
+    assert data == {
+        'title': 'Foo',
+        'slug': 'foo',
+        'a': 'x',
+        'b': 'Foo-x',
+        'c': {'d': 'foo', 'e': 1},
+        'f': ['Foo'],
+        'g': 2,
+    }
+    data2 = {'title': 'Bar', 'slug': 'bar'}
+    plan.apply(data2)
+    assert data2['c'] == {'d': 'bar', 'e': 1}
+    assert data2['f'] is not data['f']
+    assert defaults['b'] == '{{ title }}-{{ a }}'
+
+    with pytest.raises(KeyError, match='slug'):
+        plan.apply({'title': 'Foo'})
+
+
+def test_build_defaults_order(tmpdir):
+    mktree(tmpdir, {'pages': {'posts': {'foo.html': 'foo', 'bar.md': 'bar'}, 'other.html': 'other'}})
+    config = Config(
+        source_dir=str(tmpdir),
+        tmp_dir=str(tmpdir.join('tmp')),
+        defaults={
+            '/posts/*': {'a': 'posts', 'b': 'posts'},
+            '*.html': {'b': 'html'},
+            '/nothing/*': {'a': 'nothing'},
+        },
+        ignore=['/nothing/*', '/posts/bar.*'],
+    )
+    pages = build_pages(config)
+    assert {k: (v.get('a'), v.get('b')) for k, v in pages.items()} == {
+        '/posts/foo.html': ('posts', 'html'),
+        '/other.html': (None, 'html'),
+    }
+
+
+@pytest.mark.parametrize(
+    'path,matches',
+    [
+        ('/posts/foo.md', [0, 1]),
+        ('/posts/foo.html', [0, 2]),
+        ('/foo.md', [1]),
+        ('/index.html', [2, 3]),
+        ('/other.txt', []),
+    ],
+)
+def test_path_match_set(path, matches):
+    globs = ['/posts/*', '*.md', '*.html', '/index.*']
+    match_set = path_match_set(globs)
+    assert match_set.matches(path) == matches
+    assert match_set(path) is bool(matches)
+    assert [i for i, g in enumerate(globs) if PathMatch(g)(path)] == matches
+    assert path_match_set(PathMatch(g) for g in globs) is match_set
+
+
+def test_path_match_set_empty():
+    match_set = path_match_set([])
+    assert match_set('/foo.html') is False
+    assert match_set.matches('/foo.html') == []
+
+
 def test_placeholders_error(tmpdir):
     mktree(tmpdir, {'pages': {'posts/2032-06-01-testing.html': '# testing'}})
     config = Config(
@@ -262,3 +379,212 @@ def test_file_data_illegal_char():
             uri='/bar more',
             template=None,
         )
+
+
+@pytest.mark.parametrize(
+    'extra,fast',
+    [
+        ({}, True),
+        ({'foo': {'bar': [1, 2]}}, True),
+        ({'created': 123}, False),
+        ({'created': 1980000000.123456}, True),
+        ({'created': 1980000000.0}, True),
+        ({'created': '2032-06-01'}, False),
+        ({'title': 42}, False),
+        ({'template': 'foobar.jinja'}, True),
+        ({'uri': 'bar'}, False),
+        ({'uri': '/bar more'}, False),
+    ],
+)
+def test_fast_file_data(extra, fast):
+    data = {
+        'path_ref': '/bar.md',
+        'infile': Path('foo/bar.md'),
+        'template': None,
+        'title': 'Bar',
+        'slug': 'bar',
+        'created': datetime(2032, 6, 1),
+        'uri': '/bar',
+        **extra,
+    }
+    final_data = fast_file_data(data)
+    if fast:
+        assert final_data == FileData(**data).dict()
+        assert list(final_data) == list(FileData(**data).dict())
+        assert final_data['created'].utcoffset() == FileData(**data).created.utcoffset()
+    else:
+        assert final_data is None
+
+
+def test_build_front_matter_invalid(tmpdir):
+    mktree(tmpdir, {'pages': {'foobar.md': '---\nuri: /foo bar\n---\nhello', 'image.png': '*'}})
+    with pytest.raises(ValidationError, match='uri contains invalid characters: " "'):
+        build_pages(Config(source_dir=str(tmpdir)))
+
+
+def test_build_cache(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'foo.md': '# foo', 'bar.html': '{{ page.title }}', 'spam.png': '*'},
+            'theme/templates/main.jinja': 'main: {{ content }}',
+            'harrier.yml': 'build_cache: true\ncache_dir: .cache\ndefault_template: main.jinja',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    expected_tree = {
+        'foo': {'index.html': 'main: <h1 id="1-foo">foo</h1>\n'},
+        'bar': {'index.html': 'main: Bar\n'},
+        'spam.png': '*',
+    }
+    assert gettree(tmpdir.join('dist')) == expected_tree
+    assert tmpdir.join('.cache/build_manifest.pickle').check()
+    mtimes = {p: tmpdir.join('dist', p).stat().mtime_ns for p in ('foo/index.html', 'bar/index.html', 'spam.png')}
+
+    spy_get_page_data = mocker.spy(harrier.build, 'get_page_data')
+    spy_render = mocker.spy(harrier.render.Renderer, 'render_file')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == expected_tree
+    assert spy_get_page_data.call_count == 0
+    assert spy_render.call_count == 0
+    assert {p: tmpdir.join('dist', p).stat().mtime_ns for p in mtimes} == mtimes
+
+    tmpdir.join('pages/foo.md').write('# changed')
+    tmpdir.join('pages/spam.png').remove()
+    tmpdir.join('dist/bar/index.html').remove()
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'foo': {'index.html': 'main: <h1 id="1-changed">changed</h1>\n'},
+        'bar': {'index.html': 'main: Bar\n'},
+    }
+    assert spy_get_page_data.call_count == 1
+
+
+def test_build_cache_lazy_data(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'foo.html': '{{ data.foo.a }}', 'bar.html': '{{ data.bar | length }}'},
+            'data': {'foo.json': '{"a": 1}', 'bar.yml': '[1, 2]'},
+            'harrier.yml': 'build_cache: true\ncache_dir: .cache\nlazy_data: true',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {'foo': {'index.html': '1\n'}, 'bar': {'index.html': '2\n'}}
+
+    spy_render = mocker.spy(harrier.render.Renderer, 'render_file')
+    tmpdir.join('data/foo.json').write('{"a": 42}')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {'foo': {'index.html': '42\n'}, 'bar': {'index.html': '2\n'}}
+    assert [c[0][1]['infile'].name for c in spy_render.call_args_list] == ['foo.html']
+
+
+def test_build_cache_config_change(tmpdir):
+    mktree(tmpdir, {'pages': {'foo.html': '{{ config.foo }}'}, 'harrier.yml': 'build_cache: true\nfoo: 1'})
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {'foo': {'index.html': '1\n'}}
+
+    tmpdir.join('harrier.yml').write('build_cache: true\nfoo: 2')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {'foo': {'index.html': '2\n'}}
+
+
+def test_build_cache_prune(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'index.html': '{{ url("theme/main.css") }}'},
+            'theme/sass/main.scss': 'body {width: 10px}',
+            'harrier.yml': 'build_cache: true',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'index.html': '/theme/main.681301a.css\n',
+        'theme': {'main.681301a.css': 'body{width:10px}\n'},
+    }
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist'))['theme'] == {'main.681301a.css': 'body{width:10px}\n'}
+
+    tmpdir.join('theme/sass/main.scss').write('body {width: 20px}')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'index.html': '/theme/main.a1ac3a7.css\n',
+        'theme': {'main.a1ac3a7.css': 'body{width:20px}\n'},
+    }
+
+
+def test_build_cache_dist_dir_change(tmpdir):
+    mktree(tmpdir, {'pages': {'foo.html': 'foo', 'bar.html': 'bar'}, 'harrier.yml': 'build_cache: true'})
+    build(tmpdir, mode=Mode.production)
+    expected_tree = {'foo': {'index.html': 'foo\n'}, 'bar': {'index.html': 'bar\n'}}
+    assert gettree(tmpdir.join('dist')) == expected_tree
+
+    tmpdir.join('pages/bar.html').remove()
+    tmpdir.join('harrier.yml').write('build_cache: true\ndist_dir: out')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('out')) == {'foo': {'index.html': 'foo\n'}}
+    assert gettree(tmpdir.join('dist')) == expected_tree
+
+
+def test_sync_dist(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'foo.md': '# foo', 'bar.html': 'bar', 'spam.png': '*'},
+            'theme': {'templates/main.jinja': 'main: {{ content }}', 'assets/logo.svg': 'logo'},
+            'harrier.yml': 'sync_dist: true\ndefault_template: main.jinja\nno_hash: ["/*"]',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    expected_tree = {
+        'foo': {'index.html': 'main: <h1 id="1-foo">foo</h1>\n'},
+        'bar': {'index.html': 'main: bar\n'},
+        'spam.png': '*',
+        'logo.svg': 'logo',
+    }
+    assert gettree(tmpdir.join('dist')) == expected_tree
+    paths = 'foo/index.html', 'bar/index.html', 'spam.png', 'logo.svg'
+    stats = {p: tmpdir.join('dist', p).stat() for p in paths}
+
+    tmpdir.join('pages/foo.md').write('# changed')
+    tmpdir.join('pages/spam.png').remove()
+    tmpdir.join('dist/old/index.html').ensure().write('old')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'foo': {'index.html': 'main: <h1 id="1-changed">changed</h1>\n'},
+        'bar': {'index.html': 'main: bar\n'},
+        'logo.svg': 'logo',
+    }
+    for p in 'bar/index.html', 'logo.svg':
+        s = tmpdir.join('dist', p).stat()
+        assert (s.ino, s.mtime_ns) == (stats[p].ino, stats[p].mtime_ns), p
+    assert tmpdir.join('dist/foo/index.html').stat().mtime_ns != stats['foo/index.html'].mtime_ns
+
+
+def test_build_pages_parallel(tmpdir):
+    posts = {f'2032-06-0{i}-post-{i}.md': f'---\nnumber: {i}\n---\n# post {i}' for i in range(1, 8)}
+    mktree(tmpdir, {'pages': {'posts': posts, 'index.html': 'index', 'image.png': '*', 'ignore.txt': 'x'}})
+    kwargs = dict(
+        source_dir=str(tmpdir),
+        ignore=['/ignore.txt'],
+        defaults={'/posts/*': {'uri': '/blog/{slug}/', 'summary': 'post {{ title }}'}},
+    )
+    serial_pages = build_pages(Config(**kwargs))
+    parallel_pages = build_pages(Config(jobs=3, **kwargs))
+    assert list(parallel_pages.keys()) == list(serial_pages.keys())
+    assert parallel_pages == serial_pages
+    assert len(parallel_pages) == 9
+    assert parallel_pages['/posts/2032-06-03-post-3.md']['summary'] == 'post Post-3'
+
+
+def test_build_pages_parallel_errors(tmpdir, caplog):
+    mktree(tmpdir, {'pages': {'posts': {'foo.html': 'foo', 'bar.html': 'bar'}, 'spam.html': '---\nx: [\n---\n'}})
+    with pytest.raises(HarrierProblem):
+        build_pages(Config(source_dir=str(tmpdir), jobs=2, defaults={'/posts/*': {'x': '{{ missing }}'}}))
+    assert 'key error applying placeholders: "\'missing\'"' in caplog.text
+
+    caplog.clear()
+    with pytest.raises(HarrierProblem):
+        build_pages(Config(source_dir=str(tmpdir), jobs=2))
+    assert 'error parsing YAML' in caplog.text
@@ -40,6 +40,20 @@ def test_build(tmpdir, mocker):
     assert mock_mod.call_count == 2
 
 
+def test_build_jobs(tmpdir):
+    mktree(tmpdir, {'pages': {'foo.md': 'foo', 'bar.md': 'bar', 'spam.png': '*'}})
+    result = CliRunner().invoke(cli, ['build', str(tmpdir), '--jobs', '2'])
+    assert result.exit_code == 0
+    assert gettree(tmpdir.join('dist')) == {
+        'foo': {'index.html': '<p>foo</p>\n'},
+        'bar': {'index.html': '<p>bar</p>\n'},
+        'spam.png': '*',
+    }
+
+    result = CliRunner().invoke(cli, ['build', str(tmpdir), '--jobs', '0'])
+    assert result.exit_code == 2
+
+
 def test_build_bad(tmpdir):
     mktree(tmpdir, {'harrier.yml': 'whatever: whatever:\n'})
     assert not tmpdir.join('dist').check()
@@ -1,10 +1,13 @@
+import pickle
 from pathlib import Path
 
 import pytest
 
+import harrier.data
+from harrier.cache import DataCache
 from harrier.common import HarrierProblem
 from harrier.config import Config
-from harrier.data import load_data
+from harrier.data import CsvTable, LazyData, load_all, load_data, update_data
 from tests.utils import mktree
 
 
@@ -72,3 +75,164 @@ def test_invalid_yaml(tmpdir):
     config = Config(source_dir=Path(tmpdir))
     with pytest.raises(HarrierProblem):
         load_data(config)
+
+
+def test_data_cache(tmpdir, mocker):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'data': {'foo.json': '[1, 2]', 'bar/spam.yml': 'a: 1'}})
+    config = Config(source_dir=Path(tmpdir))
+    cache = DataCache(None)
+    assert load_data(config, cache) == {'foo': [1, 2], 'bar': {'spam': {'a': 1}}}
+    assert len(cache.files) == 2
+
+    spy_read = mocker.spy(harrier.data, 'read_file')
+    data = load_data(config, cache)
+    assert data == {'foo': [1, 2], 'bar': {'spam': {'a': 1}}}
+    assert spy_read.call_count == 0
+    # data from the cache is a copy
+    data['foo'].append(3)
+    assert load_data(config, cache)['foo'] == [1, 2]
+
+    # modified time changes but content doesn't
+    p = tmpdir.join('data/foo.json')
+    p.setmtime(p.mtime() + 10)
+    assert load_data(config, cache)['foo'] == [1, 2]
+    assert spy_read.call_count == 0
+
+    tmpdir.join('data/bar/spam.yml').write('a: 2')
+    tmpdir.join('data/foo.json').remove()
+    assert load_data(config, cache) == {'bar': {'spam': {'a': 2}}}
+    assert spy_read.call_count == 1
+    assert list(cache.files) == [Path(tmpdir.join('data/bar/spam.yml'))]
+
+
+def test_data_cache_save(tmpdir):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'data': {'foo.json': '[1, 2]'}})
+    config = Config(source_dir=Path(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    cache = DataCache.load(config)
+    load_data(config, cache)
+    cache.save()
+    assert tmpdir.join('cache/data.pickle').check()
+    assert DataCache.load(config).files == cache.files
+
+
+def test_parallel(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'pages/foobar.md': '# hello',
+            'data': {
+                **{f'{i}.json': f'{{"v": {i}}}' for i in range(10)},
+                'foo.csv': 'a, b\n1, 2\n',
+                'foo.yml': 'x: 1',
+            },
+        },
+    )
+    data = load_data(Config(source_dir=Path(tmpdir), jobs=2))
+    assert data == load_data(Config(source_dir=Path(tmpdir)))
+    assert data == {**{str(i): {'v': i} for i in range(10)}, 'foo': [{'a': '1', 'b': '2'}]}
+
+
+def test_parallel_error(tmpdir, caplog):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'data': {'foo.json': '[1, 2]', 'bar.yaml': '1 : 2 : 3'}})
+    with pytest.raises(HarrierProblem, match='error reading .*bar.yaml'):
+        load_data(Config(source_dir=Path(tmpdir), jobs=2))
+    assert 'error parsing file' in caplog.text
+
+
+def test_update_data(tmpdir):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'data': {'foo.json': '[1, 2]', 'bar/spam.yml': 'a: 1'}})
+    config = Config(source_dir=Path(tmpdir))
+    cache = DataCache(None)
+    data = load_data(config, cache)
+
+    tmpdir.join('data/bar/spam.yml').write('a: 2')
+    assert update_data(config, data, {Path(tmpdir.join('data/bar/spam.yml'))}, cache) is True
+    assert data == {'foo': [1, 2], 'bar': {'spam': {'a': 2}}}
+
+    # new files need all data to be loaded
+    tmpdir.join('data/new.json').write('{}')
+    assert update_data(config, data, {Path(tmpdir.join('data/new.json'))}, cache) is False
+
+
+def test_lazy_data(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages/foobar.md': '# hello',
+            'data': {'foo.json': '[1, 2]', 'bar': {'spam.yml': 'a: 1', 'eggs.csv': 'x, y\n1, 2\n'}},
+        },
+    )
+    spy_read = mocker.spy(harrier.data, 'read_file')
+    data = load_data(Config(source_dir=Path(tmpdir), lazy_data=True))
+    assert isinstance(data, LazyData)
+    assert spy_read.call_count == 0
+    assert set(data) == {'foo', 'bar'}
+    assert repr(data['bar']).startswith("{'eggs': <DataFile")
+
+    assert data['foo'] == [1, 2]
+    assert data.get('foo') == [1, 2]
+    assert spy_read.call_count == 1
+    assert data['bar']['spam'] == {'a': 1}
+    assert spy_read.call_count == 2
+
+    all_data = load_all(data)
+    assert type(all_data) is dict
+    assert data == all_data
+    assert spy_read.call_count == 3
+    assert all_data == load_data(Config(source_dir=Path(tmpdir)))
+
+    # the cache is shared by every directory and survives pickling
+    data2 = pickle.loads(pickle.dumps(data))
+    assert data2['bar']._cache is data2._cache
+    assert data2 == all_data
+
+
+def test_lazy_data_cache_size(tmpdir, mocker):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'data': {f'{i}.json': str(i) for i in range(4)}})
+    mocker.patch('harrier.data.LAZY_DATA_CACHE_SIZE', 2)
+    spy_read = mocker.spy(harrier.data, 'read_file')
+    data = load_data(Config(source_dir=Path(tmpdir), lazy_data=True))
+    assert [data[str(i)] for i in range(4)] == [0, 1, 2, 3]
+    assert len(data._cache) == 2
+    assert data['3'] == 3
+    assert spy_read.call_count == 4
+    assert data['0'] == 0
+    assert spy_read.call_count == 5
+
+
+def test_compact_csv(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'pages/foobar.md': '# hello',
+            'data': {
+                'foo.csv': 'fruit, colour, price\napple, green, 1\n\nbanana, yellow\n',
+                'bar.csv': 'a, b\n1, 2\n',
+            },
+        },
+    )
+    config = Config(source_dir=Path(tmpdir), compact_csv=['/foo.csv'])
+    data = load_data(config)
+    assert data['bar'] == [{'a': '1', 'b': '2'}]
+    foo = data['foo']
+    assert isinstance(foo, CsvTable)
+    assert foo.header == ('fruit', 'colour', 'price')
+    assert foo.rows == [('apple', 'green', '1'), ('banana', 'yellow', 'other')]
+    assert foo == load_data(Config(source_dir=Path(tmpdir)))['foo']
+    assert len(foo) == 2
+    assert foo[1]['colour'] == 'yellow'
+    assert dict(foo[0]) == {'fruit': 'apple', 'colour': 'green', 'price': '1'}
+    assert list(foo[0].values()) == ['apple', 'green', '1']
+    assert foo[1:] == [{'fruit': 'banana', 'colour': 'yellow', 'price': 'other'}]
+    assert foo.column('fruit') == ['apple', 'banana']
+    assert pickle.loads(pickle.dumps(foo)) == foo
+    with pytest.raises(KeyError):
+        foo[0]['missing']
+
+
+def test_compact_csv_cache(tmpdir):
+    mktree(tmpdir, {'pages/foobar.md': '# hello', 'data': {'foo.csv': 'a, b\n1, 2\n'}})
+    cache = DataCache(None)
+    assert isinstance(load_data(Config(source_dir=Path(tmpdir)), cache)['foo'], list)
+    data = load_data(Config(source_dir=Path(tmpdir), compact_csv=['*']), cache)
+    assert isinstance(data['foo'], CsvTable)
@@ -141,72 +141,88 @@ def test_mock_executor(tmpdir, mocker):
         {
             'pages': '__FB__',
             'assets': False,
+            'changed_assets': set(),
             'sass': False,
             'templates': False,
             'data': False,
+            'changed_data': set(),
             'extensions': False,
             'update_config': False,
         },
         {
             'pages': set(),
             'assets': False,
+            'changed_assets': set(),
             'sass': False,
             'templates': False,
             'data': False,
+            'changed_data': set(),
             'extensions': False,
             'update_config': True,
         },
         {
             'pages': {(Change.modified, Path(foobar_path))},
             'assets': False,
+            'changed_assets': set(),
             'sass': False,
             'templates': False,
             'data': False,
+            'changed_data': set(),
             'extensions': False,
             'update_config': False,
         },
         {
             'pages': set(),
-            'assets': True,
+            'assets': False,
+            'changed_assets': {Path(tmpdir.join('theme/assets/main.png'))},
             'sass': False,
             'templates': False,
             'data': False,
+            'changed_data': set(),
             'extensions': False,
             'update_config': False,
         },
         {
             'pages': set(),
             'assets': False,
+            'changed_assets': set(),
             'sass': True,
             'templates': False,
             'data': False,
+            'changed_data': set(),
             'extensions': False,
             'update_config': False,
         },
         {
             'pages': set(),
             'assets': False,
+            'changed_assets': set(),
             'sass': False,
             'templates': True,
             'data': False,
+            'changed_data': set(),
             'extensions': False,
             'update_config': False,
         },
         {
             'pages': set(),
             'assets': False,
+            'changed_assets': set(),
             'sass': False,
             'templates': False,
             'data': False,
+            'changed_data': set(),
             'extensions': True,
             'update_config': False,
         },
         {
             'pages': set(),
             'assets': False,
+            'changed_assets': set(),
             'sass': False,
             'templates': False,
-            'data': True,
+            'data': False,
+            'changed_data': {Path(tmpdir.join('data/foobar.yml'))},
             'extensions': False,
             'update_config': False,
         },
@@ -348,6 +364,27 @@ def test_dev_data(tmpdir, mocker, loop):
     }
 
 
+def test_dev_data_added(tmpdir, mocker, loop):
+    async def awatch_alt(*args, **kwargs):
+        tmpdir.join('data/foobar.yml').write('a: 2')
+        tmpdir.join('data/new.json').write('{"b": 3}')
+        yield {
+            (Change.modified, str(tmpdir.join('data/foobar.yml'))),
+            (Change.added, str(tmpdir.join('data/new.json'))),
+        }
+
+    asyncio.set_event_loop(loop)
+    mktree(
+        tmpdir, {'pages': {'foobar.html': '{{ data.foobar.a }} {{ data.get("new", {}).b }}'}, 'data/foobar.yml': 'a: 1'}
+    )
+    mocker.patch('harrier.dev.awatch', side_effect=awatch_alt)
+    mocker.patch('harrier.dev.Server', return_value=MockServer())
+
+    dev(str(tmpdir), 8000)
+
+    assert gettree(tmpdir.join('dist')) == {'foobar': {'index.html': '2 3\n'}}
+
+
 def test_ignored_directory(tmpdir, mocker, loop):
     async def awatch_alt(*args, **kwargs):
         yield {(Change.modified, str(tmpdir.join('pages/ignored.html')))}
@@ -367,3 +404,59 @@ def test_ignored_directory(tmpdir, mocker, loop):
     assert gettree(tmpdir.join('dist')) == {
         'foobar': {'index.html': '1\n'},
     }
+
+
+def test_dev_template_change(tmpdir, mocker, loop):
+    async def awatch_alt(*args, **kwargs):
+        tmpdir.join('theme/templates/bar.jinja').write('bar changed: {{ content }}')
+        yield {(Change.modified, str(tmpdir.join('theme/templates/bar.jinja')))}
+
+    asyncio.set_event_loop(loop)
+    mktree(
+        tmpdir,
+        {
+            'pages': {
+                'foo.html': '---\ntemplate: foo.jinja\n---\nfoo',
+                'bar.html': '---\ntemplate: bar.jinja\n---\nbar',
+            },
+            'theme/templates': {'foo.jinja': 'foo: {{ content }}', 'bar.jinja': 'bar: {{ content }}'},
+        },
+    )
+    mocker.patch('harrier.dev.awatch', side_effect=awatch_alt)
+    mocker.patch('harrier.dev.Server', return_value=MockServer())
+
+    assert dev(str(tmpdir), 8000) == 0
+
+    assert gettree(tmpdir.join('dist')) == {
+        'foo': {'index.html': 'foo: foo\n'},
+        'bar': {'index.html': 'bar changed: bar\n'},
+    }
+
+
+def test_dev_asset_change(tmpdir, mocker, loop):
+    async def awatch_alt(*args, **kwargs):
+        tmpdir.join('theme/assets/foo.txt').write('foo changed')
+        tmpdir.join('theme/assets/bar.txt').remove()
+        yield {
+            (Change.modified, str(tmpdir.join('theme/assets/foo.txt'))),
+            (Change.deleted, str(tmpdir.join('theme/assets/bar.txt'))),
+        }
+
+    asyncio.set_event_loop(loop)
+    mktree(
+        tmpdir,
+        {
+            'pages/index.html': 'index',
+            'theme/assets': {'foo.txt': 'foo', 'bar.txt': 'bar', 'spam.txt': 'spam'},
+        },
+    )
+    mocker.patch('harrier.dev.awatch', side_effect=awatch_alt)
+    mocker.patch('harrier.dev.Server', return_value=MockServer())
+
+    assert dev(str(tmpdir), 8000) == 0
+
+    assert gettree(tmpdir.join('dist')) == {
+        'index.html': 'index\n',
+        'foo.txt': 'foo changed',
+        'spam.txt': 'spam',
+    }
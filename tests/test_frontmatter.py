@@ -1,7 +1,9 @@
 import pytest
+from ruamel.yaml import YAMLError
 
-from harrier.common import HarrierProblem
-from harrier.frontmatter import parse_front_matter, parse_yaml, split_content
+import harrier.frontmatter
+from harrier.common import HarrierProblem, yaml
+from harrier.frontmatter import load_simple_yaml, parse_front_matter, parse_yaml, split_content
 
 
 def test_simple_front_matter():
@@ -211,3 +213,137 @@ def test_more_front_matter(s, result):
     obj, content = parse_front_matter(s)
     obj['content'] = split_content(content)
     assert obj == result
+
+
+SCALARS = [
+    'abc',
+    'Hello World',
+    'a  b',
+    "it's",
+    'a/b',
+    'x.y',
+    'a-b',
+    'a_b',
+    'a,b',
+    'a, b',
+    'a!',
+    'a?',
+    'a&b',
+    'a+b',
+    'foo (bar)',
+    'yes',
+    'No',
+    'on',
+    'y',
+    'Infinity',
+    'nan',
+    'true',
+    'True',
+    'TRUE',
+    'tRue',
+    'false',
+    'null',
+    'Null',
+    'NULL',
+    '~',
+    '0',
+    '1',
+    '-5',
+    '+5',
+    '-0',
+    '012',
+    '1_000',
+    '0x1f',
+    '0o17',
+    '1.5',
+    '1e3',
+    '.inf',
+    '2032-06-01',
+    '2032-06-01 12:00:00',
+    '"quoted"',
+    "'quoted'",
+    'a: b',
+    'a #comment',
+    'a#b',
+    '[1, 2]',
+    '{a: 1}',
+    '*alias',
+    '&anchor a',
+    '!tag a',
+    '@a',
+    '`a',
+    '%a',
+    '|',
+    '>',
+    '- a',
+    '? a',
+    'a:',
+    'café',
+    '',
+]
+
+
+def check_conformance(s):
+    simple = load_simple_yaml(s)
+    if simple is None:
+        return False
+    expected = yaml.load(s) or {}
+    assert simple == expected
+    assert [(k, type(v)) for k, v in simple.items()] == [(k, type(v)) for k, v in expected.items()]
+    return True
+
+
+@pytest.mark.parametrize('value', SCALARS)
+def test_simple_yaml_values(value):
+    try:
+        yaml.load(f'key: {value}')
+    except YAMLError:
+        assert load_simple_yaml(f'key: {value}') is None
+    else:
+        check_conformance(f'key: {value}')
+        check_conformance(f'key: {value}   \n')
+
+
+@pytest.mark.parametrize('key', SCALARS)
+def test_simple_yaml_keys(key):
+    try:
+        yaml.load(f'{key}: value')
+    except YAMLError:
+        assert load_simple_yaml(f'{key}: value') is None
+    else:
+        check_conformance(f'{key}: value')
+
+
+@pytest.mark.parametrize(
+    's,simple',
+    [
+        ('title: Testing\nslug: testing-123\norder: 4\n', True),
+        ('\ntitle: Testing\n\n  \nx: 1', True),
+        ('', True),
+        ('title: Testing\n# comment\n', False),
+        ('title: Testing\ntags:\n- a\n- b\n', False),
+        ('title: Testing\nnested:\n  a: 1\n', False),
+        ('title:\n', False),
+        ('title: Testing\nTitle: testing\n', True),
+        ('title:\tTesting', False),
+        ('title: Testing\r\n', False),
+        ('%YAML 1.1\n---\ntitle: yes\n', False),
+        ('---\ntitle: Testing\n', False),
+    ],
+)
+def test_simple_yaml_documents(s, simple):
+    assert check_conformance(s) is simple
+
+
+def test_simple_yaml_duplicate():
+    assert load_simple_yaml('title: a\ntitle: b') is None
+    with pytest.raises(HarrierProblem):
+        parse_front_matter('---\ntitle: a\ntitle: b\n---\nhello')
+
+
+def test_front_matter_simple_yaml(mocker):
+    spy_load = mocker.spy(harrier.frontmatter.yaml, 'load')
+    assert parse_front_matter('---\ntitle: Testing\nx: 1\n---\nhello') == ({'title': 'Testing', 'x': 1}, 'hello')
+    assert spy_load.call_count == 0
+    assert parse_front_matter('---\ntitle: true\n---\nhello') == ({'title': True}, 'hello')
+    assert spy_load.call_count == 1
@@ -1,3 +1,4 @@
+import os
 import re
 from datetime import datetime
 from pathlib import Path
@@ -6,10 +7,14 @@ import pytest
 from dirty_equals import IsStr
 from PIL import Image
 
+import harrier.render
 from harrier.build import FileData
-from harrier.config import Mode
+from harrier.cache import BuildManifest, LRUCache
+from harrier.common import HarrierProblem
+from harrier.config import LinkMode, Mode, get_config
 from harrier.main import build
-from harrier.render import json_filter, paginate_filter
+from harrier.output import OutputWriter, copy_file, write_bytes
+from harrier.render import Renderer, json_filter, paginate_filter
 from tests.utils import gettree, mktree
 
 
@@ -361,6 +366,25 @@ def test_paginate_filter():
     assert paginate_filter(ctx, v, 2, 2) == ['c', 'd']
 
 
+def test_csv_table(tmpdir):
+    mktree(
+        tmpdir,
+        {
+            'pages/index.html': (
+                '{% for row in data.products|paginate(2, 2) %}{{ row.name }}|{% endfor %}\n'
+                '{% for row in data.products|glob("/shoes/*", test="path") %}{{ row["name"] }}|{% endfor %}\n'
+                '{{ data.products|length }} {{ data.products[0]|tojson }} {{ data.products[1].table }}'
+            ),
+            'data/products.csv': 'name, path, table\nboot, /shoes/boot\nhat, /hats/hat, b\nclog, /shoes/clog\nsock\n',
+            'harrier.yml': 'compact_csv:\n- /products.csv',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'index.html': 'clog|sock|\nboot|clog|\n4 {"name": "boot", "path": "/shoes/boot", "table": "other"} b\n'
+    }
+
+
 def test_no_trailing_slash(tmpdir):
     mktree(
         tmpdir,
@@ -374,3 +398,394 @@ def test_no_trailing_slash(tmpdir):
         'other': {'index.html': 'xxx\n'},
         'index.html': '<a href="/other">link to other</a>\n',
     }
+
+
+def test_parallel_render(tmpdir):
+    pages = {f'page_{i}.md': f'# page {i}\n\n{{{{ page.title }}}} {{{{ config.foo }}}}' for i in range(20)}
+    mktree(
+        tmpdir,
+        {
+            'pages': {**pages, 'image.png': '*', 'robots.txt': 'whatever'},
+            'theme/templates/main.jinja': 'main:\n{{ content }}',
+            'harrier.yml': 'default_template: main.jinja\nfoo: bar',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    serial_tree = gettree(tmpdir.join('dist'))
+    assert serial_tree['page_3'] == {'index.html': 'main:\n<h1 id="1-page-3">page 3</h1>\n\n<p>Page_3 bar</p>\n'}
+    assert len(serial_tree) == 22
+
+    build(tmpdir, mode=Mode.production, jobs=3)
+    assert gettree(tmpdir.join('dist')) == serial_tree
+
+
+def test_parallel_render_error(tmpdir, caplog):
+    mktree(tmpdir, {'pages': {'foo.html': 'foo', 'bar.html': '{{ 1/0 }}'}})
+    with pytest.raises(HarrierProblem):
+        build(tmpdir, mode=Mode.production, jobs=2)
+
+
+def test_template_deps(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages': {
+                'foo.html': '---\ntemplate: foo.jinja\n---\nfoo',
+                'bar.html': '---\ntemplate: bar.jinja\n---\nbar',
+                'spam.html': 'spam',
+            },
+            'theme/templates': {
+                'base.jinja': '{% block main %}{% endblock %}',
+                'foo.jinja': (
+                    '{% extends "base.jinja" %}{% block main %}{% include "part.jinja" %}{{ content }}{% endblock %}'
+                ),
+                'bar.jinja': '{% import "macros.jinja" as m %}{{ m.square(content) }}',
+                'macros.jinja': '{% macro square(v) %}[{{ v }}]{% endmacro %}',
+                'part.jinja': 'part:',
+            },
+            'harrier.yml': 'build_cache: true\ncache_dir: .cache',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'foo': {'index.html': 'part:foo\n'},
+        'bar': {'index.html': '[bar]\n'},
+        'spam': {'index.html': 'spam\n'},
+    }
+    manifest = BuildManifest.load(get_config(str(tmpdir)))
+    pages_dir = Path(tmpdir) / 'pages'
+    assert manifest.deps == {
+        pages_dir / 'foo.html': {('template', 'foo.jinja'), ('template', 'base.jinja'), ('template', 'part.jinja')},
+        pages_dir / 'bar.html': {('template', 'bar.jinja'), ('template', 'macros.jinja')},
+        pages_dir / 'spam.html': set(),
+    }
+
+    spy_render = mocker.spy(Renderer, 'render_file')
+    tmpdir.join('theme/templates/part.jinja').write('changed:')
+    build(tmpdir, mode=Mode.production)
+    assert [c.args[1]['infile'].name for c in spy_render.call_args_list] == ['foo.html']
+    assert tmpdir.join('dist/foo/index.html').read_text('utf8') == 'changed:foo\n'
+
+    spy_render.reset_mock()
+    tmpdir.join('theme/templates/macros.jinja').write('{% macro square(v) %}({{ v }}){% endmacro %}')
+    build(tmpdir, mode=Mode.production)
+    assert [c.args[1]['infile'].name for c in spy_render.call_args_list] == ['bar.html']
+    assert tmpdir.join('dist/bar/index.html').read_text('utf8') == '(bar)\n'
+
+
+@pytest.mark.parametrize('lazy_data', [False, True])
+def test_data_attribute_names(tmpdir, lazy_data):
+    mktree(
+        tmpdir,
+        {
+            'pages/index.html': (
+                '{{ data.name }} {{ data.accessed }} {{ data.record }} {{ data.cache }} {{ data.load_all }}'
+            ),
+            'data': {
+                'name.json': '"Bob"',
+                'accessed.json': '"Alice"',
+                'record.json': '42',
+                'cache.json': '"c"',
+                'load_all.json': '"l"',
+            },
+            'harrier.yml': f'lazy_data: {str(lazy_data).lower()}',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert tmpdir.join('dist/index.html').read_text('utf8') == 'Bob Alice 42 c l\n'
+
+
+@pytest.mark.parametrize('lazy_data', [False, True])
+def test_data_glob_deps(tmpdir, mocker, lazy_data):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'index.html': '{% for t in data|glob("team*") %}{{ t.name }} {% endfor %}', 'other.html': 'x'},
+            'data': {'team_a.yml': 'name: Bob', 'other.yml': 'name: Other'},
+            'harrier.yml': f'build_cache: true\ncache_dir: .cache\nlazy_data: {str(lazy_data).lower()}',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert tmpdir.join('dist/index.html').read_text('utf8') == 'Bob\n'
+
+    spy_render = mocker.spy(Renderer, 'render_file')
+    tmpdir.join('data/other.yml').write('name: Changed')
+    build(tmpdir, mode=Mode.production)
+    assert spy_render.call_count == 0
+
+    tmpdir.join('data/team_a.yml').write('name: Alice')
+    build(tmpdir, mode=Mode.production)
+    assert [c.args[1]['infile'].name for c in spy_render.call_args_list] == ['index.html']
+    assert tmpdir.join('dist/index.html').read_text('utf8') == 'Alice\n'
+
+
+def test_file_deps(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'index.html': "{{ inline_css('style.css') }}", 'other.html': 'other'},
+            'theme/assets/style.css': 'body {color: red}',
+            'harrier.yml': "build_cache: true\ncache_dir: .cache\nno_hash: ['/style.css']",
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert tmpdir.join('dist/index.html').read_text('utf8') == 'body {color: red}\n'
+    manifest = BuildManifest.load(get_config(str(tmpdir)))
+    assert manifest.deps[Path(tmpdir) / 'pages/index.html'] == {('file', str(tmpdir.join('dist/style.css')))}
+
+    spy_render = mocker.spy(Renderer, 'render_file')
+    tmpdir.join('theme/assets/style.css').write('body {color: blue}')
+    build(tmpdir, mode=Mode.production)
+    assert [c.args[1]['infile'].name for c in spy_render.call_args_list] == ['index.html']
+    assert tmpdir.join('dist/style.css').read_text('utf8') == 'body {color: blue}'
+    assert tmpdir.join('dist/index.html').read_text('utf8') == 'body {color: blue}\n'
+
+
+def test_som_deps(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages': {
+                'index.html': '{% for p in pages|glob("/posts/*") %}{{ p.title }} {% endfor %}',
+                'first.html': '{{ pages["/posts/a.md"].title }}',
+                'about.html': '{{ data.team.name }}',
+                'static.html': 'static',
+                'posts': {'a.md': '---\ntitle: A\n---\na', 'b.md': '---\ntitle: B\n---\nb'},
+            },
+            'data': {'team.yml': 'name: Bob', 'other.yml': 'x: 1'},
+            'harrier.yml': 'build_cache: true\ncache_dir: .cache',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'index.html': 'A B\n',
+        'first': {'index.html': 'A\n'},
+        'about': {'index.html': 'Bob\n'},
+        'static': {'index.html': 'static\n'},
+        'posts': {'a': {'index.html': '<p>a</p>\n'}, 'b': {'index.html': '<p>b</p>\n'}},
+    }
+    pages_dir = Path(tmpdir) / 'pages'
+    manifest = BuildManifest.load(get_config(str(tmpdir)))
+    assert manifest.deps[pages_dir / 'index.html'] == {('pages', ('glob', 'path', ('/posts/*',)))}
+    assert manifest.deps[pages_dir / 'first.html'] == {('pages', '/posts/a.md')}
+    assert manifest.deps[pages_dir / 'about.html'] == {('data', 'team')}
+
+    spy_render = mocker.spy(Renderer, 'render_file')
+
+    def rendered():
+        names = sorted(str(c.args[1]['infile'].relative_to(pages_dir)) for c in spy_render.call_args_list)
+        spy_render.reset_mock()
+        return names
+
+    tmpdir.join('data/other.yml').write('x: 2')
+    build(tmpdir, mode=Mode.production)
+    assert rendered() == []
+
+    tmpdir.join('data/team.yml').write('name: Alice')
+    build(tmpdir, mode=Mode.production)
+    assert rendered() == ['about.html']
+    assert tmpdir.join('dist/about/index.html').read_text('utf8') == 'Alice\n'
+
+    tmpdir.join('pages/posts/b.md').write('---\ntitle: C\n---\nb')
+    build(tmpdir, mode=Mode.production)
+    assert rendered() == ['index.html', 'posts/b.md']
+    assert tmpdir.join('dist/index.html').read_text('utf8') == 'A C\n'
+
+    tmpdir.join('pages/misc.html').write('misc')
+    build(tmpdir, mode=Mode.production)
+    assert rendered() == ['misc.html']
+
+    tmpdir.join('pages/posts/c.md').write('---\ntitle: D\n---\nd')
+    build(tmpdir, mode=Mode.production)
+    assert rendered() == ['index.html', 'posts/c.md']
+    assert tmpdir.join('dist/index.html').read_text('utf8') == 'A C D\n'
+
+
+def test_output_writer(tmpdir):
+    mktree(tmpdir, {'src.txt': 'copied'})
+    writer = OutputWriter(max_queued=2)
+    for i in range(10):
+        writer.write(Path(tmpdir) / f'{i}.txt', f'content {i}'.encode())
+    writer.copy_file(Path(tmpdir) / 'src.txt', Path(tmpdir) / 'dst.txt')
+    assert writer.close() == (10, 1)
+    tree = gettree(tmpdir)
+    assert len(tree) == 12
+    assert tree['9.txt'] == 'content 9'
+    assert tree['dst.txt'] == 'copied'
+    assert writer.close() == (10, 1)
+
+
+def test_output_writer_error(tmpdir, caplog):
+    writer = OutputWriter()
+    writer.write(Path(tmpdir) / 'missing' / 'foo.txt', b'foo')
+    with pytest.raises(FileNotFoundError):
+        writer.close()
+    assert 'foo.txt' in caplog.text
+
+
+def test_bytecode_cache(tmpdir, mocker):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'foo.md': '# foo', 'bar.html': '{% extends "base.jinja" %}'},
+            'theme/templates': {'main.jinja': 'main: {{ content }}', 'base.jinja': 'base {{ page.title }}'},
+            'harrier.yml': 'cache_dir: .cache\ndefault_template: main.jinja',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    # content templates aren't cached
+    assert len(tmpdir.join('.cache/jinja').listdir()) == 2
+
+    spy_compile = mocker.spy(harrier.render.TrackingEnvironment, 'compile')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'foo': {'index.html': 'main: <h1 id="1-foo">foo</h1>\n'},
+        'bar': {'index.html': 'main: base Bar\n'},
+    }
+    assert spy_compile.call_count == 2
+
+    tmpdir.join('theme/templates/base.jinja').write('changed {{ page.title }}')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist'))['bar'] == {'index.html': 'main: changed Bar\n'}
+    assert spy_compile.call_count == 5
+
+
+def test_content_not_written(tmpdir, caplog):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'foo.md': '# foo', 'bar.html': '---\ntitle: Bar\n---\nline 1\nline 2\n{{ missing() }}'},
+            'harrier.yml': f'tmp_dir: {tmpdir.join("tmp")}',
+        },
+    )
+    with pytest.raises(HarrierProblem):
+        build(tmpdir, mode=Mode.production)
+    assert tmpdir.join('tmp').listdir() == []
+    assert 'File "content/bar.html", line 3' in caplog.text
+
+
+def test_lru_cache(tmpdir):
+    cache = LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert list(cache.data) == ['a', 'c']
+
+    path = Path(tmpdir) / 'cache.pickle'
+    cache.save(path)
+    cache2 = LRUCache(5)
+    cache2.track_new()
+    cache2.load(path)
+    assert dict(cache2.data) == {'a': 1, 'c': 3}
+    assert cache2.pop_new() == {'a': 1, 'c': 3}
+    cache2.set('d', 4)
+    assert cache2.pop_new() == {'d': 4}
+
+
+def test_markdown_cache(tmpdir, mocker):
+    footer = '{% markdown %}\n**shared footer**\n{% endmarkdown %}'
+    mktree(
+        tmpdir,
+        {
+            'pages': {'foo.md': '# foo', 'bar.md': '# bar', 'spam.md': '# foo'},
+            'theme/templates/main.jinja': '{{ content }}' + footer,
+            'harrier.yml': 'build_cache: true\ncache_dir: .cache\ndefault_template: main.jinja',
+        },
+    )
+    spy_md = mocker.spy(harrier.render.Markdown, '__call__')
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist'))['spam'] == {
+        'index.html': '<h1 id="1-foo">foo</h1>\n<p><strong>shared footer</strong></p>\n'
+    }
+    # "# foo" is only rendered once, as is the footer
+    assert spy_md.call_count == 3
+    assert tmpdir.join('.cache/markdown.pickle').check()
+
+    tmpdir.join('pages/bar.md').write('# changed')
+    build(tmpdir, mode=Mode.production)
+    assert spy_md.call_count == 4
+
+
+def test_highlight_cache(tmpdir, mocker):
+    code = '```py\nx = 1\n```\n'
+    mktree(tmpdir, {'pages': {'foo.md': f'# foo\n{code}', 'bar.md': f'# bar\n{code}', 'spam.md': '```\nx\n```'}})
+    spy_highlight = mocker.spy(harrier.render, 'highlight')
+    build(tmpdir, mode=Mode.production)
+    tree = gettree(tmpdir.join('dist'))
+    assert tree['foo']['index.html'].replace('foo', 'bar') == tree['bar']['index.html']
+    assert '<div class="hi"><pre>' in tree['foo']['index.html']
+    assert tree['spam']['index.html'] == '<pre><code>x</code></pre>\n'
+    assert spy_highlight.call_count == 1
+
+
+@pytest.mark.parametrize('link_mode', list(LinkMode))
+def test_link_mode(tmpdir, link_mode):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'index.html': 'index', 'static/image.png': '*'},
+            'theme/assets/logo.svg': 'logo',
+            'harrier.yml': f'link_mode: {link_mode.value}\nno_hash: ["/*"]',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert gettree(tmpdir.join('dist')) == {
+        'index.html': 'index\n',
+        'static': {'image.png': '*'},
+        'logo.svg': 'logo',
+    }
+    for src, dst in [('pages/static/image.png', 'dist/static/image.png'), ('theme/assets/logo.svg', 'dist/logo.svg')]:
+        src, dst = Path(tmpdir.join(src)), Path(tmpdir.join(dst))
+        assert dst.is_symlink() == (link_mode == LinkMode.symlink)
+        assert dst.samefile(src) == (link_mode in {LinkMode.hardlink, LinkMode.symlink})
+
+
+@pytest.mark.parametrize('option', ['sync_dist', 'build_cache'])
+def test_symlink_source_deleted(tmpdir, option):
+    mktree(
+        tmpdir,
+        {
+            'pages': {'index.html': 'index', 'image.png': '*'},
+            'theme/assets/logo.svg': 'logo',
+            'harrier.yml': f'link_mode: symlink\n{option}: true\nno_hash: ["/*"]',
+        },
+    )
+    build(tmpdir, mode=Mode.production)
+    assert tmpdir.join('dist/image.png').islink()
+    assert tmpdir.join('dist/logo.svg').islink()
+
+    tmpdir.join('pages/image.png').remove()
+    tmpdir.join('theme/assets/logo.svg').remove()
+    build(tmpdir, mode=Mode.production)
+    assert os.listdir(tmpdir.join('dist')) == ['index.html']
+
+
+@pytest.mark.parametrize('link_mode', [LinkMode.hardlink, LinkMode.symlink])
+def test_write_replaces_link(tmpdir, link_mode):
+    src, dst = Path(tmpdir) / 'src.txt', Path(tmpdir) / 'dst.txt'
+    src.write_text('source')
+    assert copy_file(src, dst, link_mode=link_mode) is True
+    assert dst.samefile(src)
+    assert copy_file(src, dst, sync=True, link_mode=link_mode) is False
+
+    assert write_bytes(dst, b'changed') is True
+    assert src.read_text() == 'source'
+    assert dst.read_text() == 'changed'
+    assert not dst.samefile(src)
+
+
+def test_output_writer_threads(tmpdir):
+    mktree(tmpdir, {'src': {f'{i}.txt': f'file {i}' for i in range(20)}, 'dst': {}})
+    writer = OutputWriter(threads=4, max_queued=2)
+    for i in range(20):
+        writer.copy_file(Path(tmpdir) / 'src' / f'{i}.txt', Path(tmpdir) / 'dst' / f'{i}.txt')
+        writer.write(Path(tmpdir) / 'dst' / f'{i}.html', f'page {i}'.encode())
+    assert len(writer.workers) == 4
+    assert writer.close() == (20, 20)
+    assert writer.workers == []
+    tree = gettree(tmpdir.join('dst'))
+    assert len(tree) == 40
+    assert tree['19.txt'] == 'file 19'
+    assert tree['19.html'] == 'page 19'